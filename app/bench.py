@@ -0,0 +1,251 @@
+"""Benchmark the under camera's ImageSizer on recorded frames.
+
+Runs each frame of a recording through measuring, annotating and encoding,
+at every combination of the given resolutions and thresholds, and reports
+per-stage timings, frames per second and peak memory.
+
+Results can be written as JSON, and compared against an earlier run
+(e.g. of another commit) with --baseline.
+"""
+
+import argparse
+import collections
+import dataclasses
+import json
+import logging
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+import typing as t
+
+import cv2
+
+from . import camera
+from . import config
+from . import sources
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Timings of one run, in seconds, by stage name
+Timings = t.Dict[str, t.List[float]]
+
+
+def parse_resolution(value: str) -> t.Tuple[int, int]:
+    """Parse a WIDTHxHEIGHT resolution."""
+    try:
+        width, height = value.lower().split("x")
+        return (int(width), int(height))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got {value}.")
+
+
+def summarise(samples: t.Sequence[float]) -> t.Dict[str, float]:
+    """Summarise durations (in seconds) as milliseconds."""
+    ordered = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def run(
+    sizer: camera.ImageSizer,
+    frames: t.Sequence[camera.Image],
+    threshold: int,
+    repeat: int = 1,
+) -> t.Dict[str, t.Any]:
+    """Time processing every frame `repeat` times, after one untimed warm up pass.
+
+    Frames are processed as the Camera would:
+    measured through a FrameContext, annotated, then encoded.
+    Peak memory is traced in a further untimed pass, as tracing slows down
+    every allocation, on a cold buffer pool so the buffers the pipeline
+    keeps count too. Undistortion maps, built once per resolution, do not.
+    """
+    timings: Timings = collections.defaultdict(list)
+
+    def timer(name: str, seconds: float) -> None:
+        timings[name].append(seconds)
+
+    def process(
+        sizer: camera.ImageSizer, frame: camera.Image, timed: bool = False
+    ) -> int:
+        start = time.perf_counter()
+        context = camera.FrameContext(frame, sizer.buffers, timer if timed else None)
+        measurement = sizer.measure_context(context, threshold=threshold)
+        measured = time.perf_counter()
+        output, _ = sizer.annotate_frame(measurement)
+        annotated = time.perf_counter()
+        cv2.imencode(".jpg", output)
+        encoded = time.perf_counter()
+        if timed:
+            timings["measure"].append(measured - start)
+            timings["annotate"].append(annotated - measured)
+            timings["encode"].append(encoded - annotated)
+            timings["total"].append(encoded - start)
+        return len(measurement.rects)
+
+    # Warm up, e.g. building undistortion maps and filling buffer pools
+    for frame in frames:
+        process(sizer, frame)
+
+    objects = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            objects.append(process(sizer, frame, timed=True))
+    elapsed = time.perf_counter() - start
+
+    cold = dataclasses.replace(sizer, buffers=camera.BufferPool(sizer.buffers.limit))
+    tracemalloc.start()
+    for frame in frames:
+        process(cold, frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = len(frames) * repeat
+    return {
+        "frames": count,
+        "fps": count / elapsed,
+        "objects": statistics.mean(objects),
+        "peak_memory_bytes": peak,
+        "stages": {
+            name: summarise(samples)
+            for name, samples in timings.items()
+            if name != "source"
+        },
+    }
+
+
+def revision() -> t.Optional[str]:
+    """Current git commit, if there is one."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(
+    results: t.Sequence[t.Mapping[str, t.Any]],
+    baseline: t.Optional[t.Mapping[str, t.Any]] = None,
+) -> str:
+    """Format results as a table, with the change in fps from a baseline."""
+    previous = {}
+    if baseline is not None:
+        previous = {
+            (tuple(result["resolution"]), result["threshold"]): result
+            for result in baseline["results"]
+        }
+    lines = []
+    for result in results:
+        resolution = "x".join(str(x) for x in result["resolution"])
+        line = (
+            f"{resolution:>10} threshold {result['threshold']:>3}:"
+            f" {result['fps']:7.1f} fps,"
+            f" {result['objects']:.1f} objects,"
+            f" peak {result['peak_memory_bytes'] / 1024:.0f} KiB"
+        )
+        before = previous.get((tuple(result["resolution"]), result["threshold"]))
+        if before is not None:
+            line += f" ({(result['fps'] / before['fps'] - 1) * 100:+.1f}% fps)"
+        lines.append(line)
+        stages = ", ".join(
+            f"{name} {stage['median_ms']:.2f}"
+            for name, stage in result["stages"].items()
+        )
+        lines.append(f"{'':>10} median ms: {stages}")
+    return "\n".join(lines)
+
+
+def cmd(arguments: t.Optional[t.Sequence[str]] = None) -> None:
+    """Run argparse and command-line functionality."""
+    parser = argparse.ArgumentParser(description="Benchmark the under camera sizing.")
+    parser.add_argument(
+        "recording", help="Directory of recorded frames, or a video file."
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=parse_resolution,
+        nargs="+",
+        default=[
+            tuple(config.camera.preview_resolution),
+            tuple(config.camera.resolution),
+        ],
+        help="Resolutions (WIDTHxHEIGHT) to resize frames to.",
+    )
+    parser.add_argument(
+        "--thresholds",
+        type=int,
+        nargs="+",
+        default=[config.web.threshold],
+        help="Thresholds to segment with.",
+    )
+    parser.add_argument(
+        "--frames", type=int, default=50, help="Most frames of the recording to use."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Times to process each frame."
+    )
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="Segment against the calibrated background model, if there is one.",
+    )
+    parser.add_argument("--output", help="File to write JSON results to.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare.")
+
+    args = parser.parse_args(arguments)
+
+    sizer = camera.configured_sizer()
+    if not args.background:
+        sizer = dataclasses.replace(sizer, background=None)
+
+    recording = sources.ReplaySource(args.recording, loop=False).recording()
+    corpus = [frame for _, frame in zip(range(args.frames), recording)]
+    if not corpus:
+        parser.error(f"No frames in {args.recording}.")
+
+    results = []
+    for resolution in args.resolutions:
+        frames = [
+            cv2.resize(frame, resolution, interpolation=cv2.INTER_AREA)
+            for frame in corpus
+        ]
+        for threshold in args.thresholds:
+            result = run(sizer, frames, threshold, repeat=args.repeat)
+            results.append(
+                {"resolution": list(resolution), "threshold": threshold, **result}
+            )
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print(report(results, baseline))
+
+    output = {
+        "revision": revision(),
+        "recording": args.recording,
+        "capture": config.camera.capture,
+        "repeat": args.repeat,
+        # Kilobytes on Linux
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    cmd()
@@ -1,14 +1,39 @@
 #!usr/bin/env python3
 """Methods to help calibrate a camera."""
 
+import argparse
+import concurrent.futures
+import hashlib
 import os
 import pathlib
-import sys
+import logging
+import re
+import threading
+import typing as t
 
 import cv2
 import numpy
 
+from . import calibration
 from . import camera
+from . import config
+
+if t.TYPE_CHECKING:
+    from . import worker
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Inner corners of the calibration chessboard, across and down
+BOARD_WIDTH = 7
+BOARD_HEIGHT = 5
+
+# Width images are downscaled to when first checking for a chessboard
+CHECK_WIDTH = 640
+
+# Result of looking for a chessboard in an image:
+# (corners, or None if not found, (width, height) of the image)
+Detection = t.Tuple[t.Optional[numpy.ndarray], t.Tuple[int, int]]
 
 
 def next_name(path: str) -> str:
@@ -31,11 +56,10 @@ def next_name(path: str) -> str:
     return f"{name}{index}{extension}"
 
 
-def save_snapshot(width, height) -> None:
+def save_snapshot(cam: "worker.AnyCamera", width, height) -> None:
     """Take a snapshot from the camera and pull chessboard data."""
-    _, result = camera.Camera(
-        processor=camera.ChessboardFinder(width, height)
-    ).get_processed_frame()
+    frame = cam.wait_frame()
+    _, result = camera.ChessboardFinder(width, height).process_frame(frame.image)
     data, encoded = result
     # print(data, encoded)
     pathlib.Path("corners").mkdir(parents=True, exist_ok=True)
@@ -46,13 +70,62 @@ def save_snapshot(width, height) -> None:
         imFile.write(encoded)
 
 
+def board_points(width: int, height: int) -> numpy.ndarray:
+    """Positions of a chessboard's inner corners, in squares, on its own plane."""
+    objp = numpy.zeros((height * width, 3), numpy.float32)
+    objp[:, :2] = numpy.mgrid[0:height, 0:width].T.reshape(-1, 2)
+    return objp
+
+
+def solve_parameters(
+    objpoints: t.Sequence[numpy.ndarray],
+    imgpoints: t.Sequence[numpy.ndarray],
+    size: t.Tuple[int, int],
+) -> None:
+    """Find camera and distortion parameters from matched corners.
+
+    Saves them as a calibration bundle, see calibration.
+    """
+    ret, camMatrix, distCoeffs, rvecs, tvecs = cv2.calibrateCamera(
+        objpoints, imgpoints, size, None, None
+    )
+
+    print(ret, camMatrix, distCoeffs, rvecs, tvecs, sep="\nNEXT\n")
+
+    # Calculate error
+    mean_error = 0
+    for i in range(len(objpoints)):
+        imgpoints2, _ = cv2.projectPoints(
+            objpoints[i], rvecs[i], tvecs[i], camMatrix, distCoeffs
+        )
+        error = cv2.norm(imgpoints[i], imgpoints2, cv2.NORM_L2) / len(imgpoints2)
+        mean_error += error
+
+    print(f"Error: {mean_error/len(objpoints)}")
+
+    # The platform's scale is not found from the chessboard,
+    # so is carried over from the current calibration
+    current = calibration.configured()
+    pixels_per_cm = current.pixels_per_cm * size[0] / current.resolution[0]
+    calibration.save(
+        calibration.build(
+            camMatrix,
+            distCoeffs.ravel(),
+            size,
+            pixels_per_cm,
+            calibration.map_resolutions(),
+        ),
+        "newCameraCalibration.npz",
+    )
+    print("Saved newCameraCalibration.npz, replace the configured bundle with it")
+
+
 def calculate_parameters(width, height, amount) -> None:
     """Use saved corner arrays and images to find camera and distortion parameters."""
     objpoints = []
     imgpoints = []
 
-    objp = numpy.zeros((height * width, 3), numpy.float32)
-    objp[:, :2] = numpy.mgrid[0:height, 0:width].T.reshape(-1, 2)
+    objp = board_points(width, height)
 
     NUM_CORNERS = amount
 
@@ -72,28 +145,462 @@ def calculate_parameters(width, height, amount) -> None:
 
     print(image.shape)
 
-    ret, camMatrix, distCoeffs, rvecs, tvecs = cv2.calibrateCamera(
-        objpoints, imgpoints, (image.shape[1], image.shape[0]), None, None
+    solve_parameters(objpoints, imgpoints, (image.shape[1], image.shape[0]))
+
+
+def check_corners(
+    image: camera.Image, width: int, height: int
+) -> t.Optional[numpy.ndarray]:
+    """Quickly look for a chessboard's inner corners in a grayscale image.
+
+    The board is looked for in a copy downscaled to CHECK_WIDTH,
+    which quickly rules out images without one.
+    Corners are returned in the image's coordinates, only roughly placed.
+    """
+    pattern = (height, width)
+    factor = max(image.shape[1] / CHECK_WIDTH, 1.0)
+    small = image
+    if factor > 1:
+        small = cv2.resize(
+            image,
+            (CHECK_WIDTH, round(image.shape[0] / factor)),
+            interpolation=cv2.INTER_AREA,
+        )
+    found, corners = cv2.findChessboardCorners(
+        small,
+        pattern,
+        flags=cv2.CALIB_CB_ADAPTIVE_THRESH
+        | cv2.CALIB_CB_NORMALIZE_IMAGE
+        | cv2.CALIB_CB_FAST_CHECK,
     )
+    if not found:
+        return None
+    # Scale corners back up, so each lands within a few pixels of the true corner,
+    # shaped (n, 1, 2) as OpenCV versions differ in what they return
+    return (corners.reshape(-1, 1, 2) * factor).astype(numpy.float32)
 
-    print(ret, camMatrix, distCoeffs, rvecs, tvecs, sep="\nNEXT\n")
 
-    # Calculate error
-    mean_error = 0
-    for i in range(len(objpoints)):
-        imgpoints2, _ = cv2.projectPoints(
-            objpoints[i], rvecs[i], tvecs[i], camMatrix, distCoeffs
+def find_corners(
+    image: camera.Image, width: int, height: int
+) -> t.Optional[numpy.ndarray]:
+    """Find a chessboard's inner corners in a grayscale image, to sub-pixel accuracy.
+
+    Corners found by check_corners are refined on the full resolution image.
+    """
+    corners = check_corners(image, width, height)
+    if corners is None:
+        return None
+    factor = max(image.shape[1] / CHECK_WIDTH, 1.0)
+    # Search window big enough to cover the error of the downscaled estimate
+    window = max(5, int(factor * 2) + 3)
+    return cv2.cornerSubPix(
+        image,
+        corners,
+        (window, window),
+        (-1, -1),
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01),
+    )
+
+
+def detect_file(path: str, width: int, height: int, cache: str) -> Detection:
+    """Find chessboard corners in an image file, through the cache.
+
+    Results are cached in `cache` by the hash of the file's contents,
+    so each image is only searched once. Run in a worker process.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    digest = hashlib.sha1(data).hexdigest()
+    cached = os.path.join(cache, f"{digest}.npz")
+    try:
+        with numpy.load(cached) as saved:
+            corners = saved["corners"]
+            width, height = (int(x) for x in saved["size"])
+            return (corners if corners.size else None, (width, height))
+    except (OSError, KeyError, ValueError):
+        pass
+
+    image = cv2.imdecode(numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Could not read image {path}.")
+    size = (image.shape[1], image.shape[0])
+    corners = find_corners(image, width, height)
+
+    # Saved to a temporary name first, so an interrupted run leaves no partial entry
+    temporary = cached + ".tmp.npz"
+    numpy.savez(
+        temporary,
+        corners=(
+            corners if corners is not None else numpy.empty((0, 1, 2), numpy.float32)
+        ),
+        size=numpy.array(size),
+    )
+    os.replace(temporary, cached)
+    return (corners, size)
+
+
+def detect_directory(
+    directory: str,
+    width: int,
+    height: int,
+    processes: t.Optional[int] = None,
+) -> t.Dict[str, Detection]:
+    """Find chessboard corners in every image in a directory, in parallel.
+
+    Images are spread over a pool of `processes` (default one per CPU),
+    and results are cached under the directory by pattern and image hash,
+    so running again after adding images only searches the new ones.
+    """
+    paths = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"))
+    )
+    cache = os.path.join(directory, ".corners", f"{width}x{height}")
+    pathlib.Path(cache).mkdir(parents=True, exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = {
+            path: executor.submit(detect_file, path, width, height, cache)
+            for path in paths
+        }
+        return {path: future.result() for path, future in futures.items()}
+
+
+def calculate_parameters_batch(
+    directory: str, width: int, height: int, processes: t.Optional[int] = None
+) -> None:
+    """Find camera and distortion parameters from a directory of chessboard images.
+
+    Images should be unannotated, e.g. not those saved by save_snapshot,
+    and all at the same resolution.
+    """
+    detections = detect_directory(directory, width, height, processes)
+    sizes = {size for _, size in detections.values()}
+    if len(sizes) != 1:
+        raise ValueError(f"Expected images of one size, got {sorted(sizes)}.")
+    objp = board_points(width, height)
+    imgpoints = [corners for corners, _ in detections.values() if corners is not None]
+    print(f"Found the board in {len(imgpoints)} of {len(detections)} images")
+    if not imgpoints:
+        raise ValueError(f"No chessboards found in {directory}.")
+    solve_parameters([objp] * len(imgpoints), imgpoints, sizes.pop())
+
+
+class CalibrationSession:
+    """Live calibration: snaps stills whenever a steady chessboard adds coverage.
+
+    While running, each preview frame is quickly checked for the board.
+    Once the board has held still for a few frames in a pose
+    covering new parts of the frame, a full resolution still is captured,
+    its corners are confirmed, and it is saved for calculate_parameters_batch.
+
+    Coverage is tracked as the cells of a grid over the frame that corners of
+    snapped boards have fallen in, and is shown as a heat map by .get_jpg,
+    which with .wait_frame lets the session be streamed like a camera.
+    """
+
+    # Columns and rows of the coverage grid
+    GRID: t.Tuple[int, int] = (8, 6)
+    # Snaps of a cell before it counts as fully covered (hottest on the map)
+    TARGET: int = 3
+    # New cells a pose must cover to be snapped
+    MIN_NEW_CELLS: int = 2
+    # Frames the board must hold still for, and how far (as a fraction
+    # of the frame width) its corners may move between them
+    STEADY_FRAMES: int = 3
+    STEADY_DISTANCE: float = 0.005
+    # Seconds to wait for frames, so stopping is noticed
+    TIMEOUT: float = 1
+
+    def __init__(
+        self,
+        camera_factory: t.Callable[[], "worker.AnyCamera"],
+        width: int,
+        height: int,
+        directory: str = "images/calibration",
+    ) -> None:
+        """Construct a new CalibrationSession for boards of width x height corners.
+
+        Stills are saved into `directory`.
+        """
+        self.camera_factory = camera_factory
+        self.width = width
+        self.height = height
+        self.directory = directory
+
+        self.lock = threading.Lock()
+        self.thread: t.Optional[threading.Thread] = None
+        self.running = False
+        # Snaps per grid cell, by (row, column)
+        self.coverage = numpy.zeros(self.GRID[::-1], dtype=numpy.int32)
+        self.snaps = 0
+        # Corners in the latest checked frame, as fractions of the frame
+        self.corners: t.Optional[numpy.ndarray] = None
+
+    def start(self) -> None:
+        """Start checking frames, if not already, continuing any coverage."""
+        with self.lock:
+            if self.running and self.thread is not None and self.thread.is_alive():
+                return
+            # A thread still stopping (e.g. just after .stop) is finished first
+            previous = self.thread
+        if previous is not None:
+            previous.join()
+        with self.lock:
+            # Unless another call started one meanwhile
+            if self.thread is None or self.thread is previous:
+                self.running = True
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def stop(self) -> None:
+        """Stop checking frames, keeping coverage for a later start."""
+        with self.lock:
+            self.running = False
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def reset(self) -> None:
+        """Forget coverage, e.g. to start calibrating over."""
+        with self.lock:
+            self.coverage[:] = 0
+            self.snaps = 0
+
+    def status(self) -> t.Dict[str, t.Any]:
+        """Whether the session is running, snaps taken and fraction covered."""
+        with self.lock:
+            return {
+                "running": self.running,
+                "snaps": self.snaps,
+                "coverage": float(numpy.mean(self.coverage > 0)),
+                "board": self.corners is not None,
+            }
+
+    def cells(self, corners: numpy.ndarray) -> t.Set[t.Tuple[int, int]]:
+        """Grid cells (row, column) that corners (as fractions) fall in."""
+        columns, rows = self.GRID
+        indices = numpy.minimum(
+            corners.reshape(-1, 2) * (columns, rows), (columns - 1, rows - 1)
+        ).astype(int)
+        return {(row, column) for column, row in indices}
+
+    def run(self) -> None:
+        """Check frames until stopped.
+
+        Should not be called manually, is run in a thread by .start.
+        """
+        cam = self.camera_factory()
+        sequence = 0
+        steady = 0
+        previous: t.Optional[numpy.ndarray] = None
+        while True:
+            with self.lock:
+                if not self.running:
+                    self.thread = None
+                    self.corners = None
+                    break
+            try:
+                frame = cam.wait_frame(newer_than=sequence, timeout=self.TIMEOUT)
+            except TimeoutError:
+                continue
+            sequence = frame.sequence
+            image = monoscale(frame.image)
+            corners = check_corners(image, self.width, self.height)
+            if corners is not None:
+                corners = corners / (image.shape[1], image.shape[0])
+            with self.lock:
+                self.corners = corners
+                new_cells = 0
+                if corners is not None:
+                    new_cells = sum(
+                        not self.coverage[cell] for cell in self.cells(corners)
+                    )
+
+            # Count how long the board has held still
+            if corners is None:
+                steady = 0
+            elif previous is not None and (
+                numpy.abs(corners - previous).max() < self.STEADY_DISTANCE
+            ):
+                steady += 1
+            else:
+                steady = 1
+            previous = corners
+
+            if steady >= self.STEADY_FRAMES and new_cells >= self.MIN_NEW_CELLS:
+                try:
+                    self.snap(cam, frame.timestamp)
+                except Exception as e:
+                    logger.error("Calibration snap failed: %s", e)
+                steady = 0
+        logger.info("Stopped calibration session")
+
+    def snap(self, cam: "worker.AnyCamera", after: float) -> bool:
+        """Capture and save a still, if its board is confirmed at full resolution."""
+        still = cam.capture_still(after=after).image
+        image = monoscale(still)
+        corners = find_corners(image, self.width, self.height)
+        if corners is None:
+            logger.info("Board not found in calibration still")
+            return False
+        pathlib.Path(self.directory).mkdir(parents=True, exist_ok=True)
+        # Saved losslessly, so the batch calibration sees exactly this
+        path = next_name(os.path.join(self.directory, "image.png"))
+        cv2.imwrite(path, still)
+        with self.lock:
+            for cell in self.cells(corners / (image.shape[1], image.shape[0])):
+                self.coverage[cell] += 1
+            self.snaps += 1
+        logger.info("Saved calibration still %s", path)
+        return True
+
+    def wait_frame(
+        self,
+        newer_than: int = 0,
+        timeout: t.Optional[float] = None,
+        *,
+        after: t.Optional[float] = None,
+    ) -> camera.Frame:
+        """Wait for a preview frame, as camera.Camera.wait_frame."""
+        return self.camera_factory().wait_frame(
+            newer_than=newer_than, timeout=timeout, after=after
         )
-        error = cv2.norm(imgpoints[i], imgpoints2, cv2.NORM_L2) / len(imgpoints2)
-        mean_error += error
 
-    numpy.savetxt("newCameraMatrix.txt", camMatrix, delimiter=",")
-    numpy.savetxt("newCameraDistortion.txt", distCoeffs, delimiter=",")
+    def get_jpg(self, frame: camera.Frame, **options: t.Any) -> bytes:
+        """Encode the frame with the coverage heat map and latest board drawn on."""
+        image = frame.image
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        size = (image.shape[1], image.shape[0])
+        with self.lock:
+            heat = numpy.minimum(self.coverage, self.TARGET) * (255 // self.TARGET)
+            corners = self.corners
+            snaps = self.snaps
+        heat_map = cv2.applyColorMap(
+            cv2.resize(heat.astype(numpy.uint8), size, interpolation=cv2.INTER_NEAREST),
+            cv2.COLORMAP_JET,
+        )
+        output = cv2.addWeighted(image, 0.7, heat_map, 0.3, gamma=0)
+        if corners is not None:
+            cv2.drawChessboardCorners(
+                output,
+                (self.height, self.width),
+                (corners * size).astype(numpy.float32),
+                True,
+            )
+        cv2.putText(
+            output,
+            text=f"{snaps} snaps, {numpy.mean(heat > 0):.0%} covered",
+            org=(4, 16),
+            fontFace=cv2.FONT_HERSHEY_PLAIN,
+            fontScale=1.0,
+            color=config.camera.colours.green,
+            thickness=1,
+        )
+        return cv2.imencode(".jpg", output)[1].tobytes()
 
-    print(f"Error: {mean_error/len(objpoints)}")
+
+def monoscale(image: camera.Image) -> camera.Image:
+    """The image in grayscale, as captured in luma mode or converted."""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def platform_roi(
+    image: camera.Image, sizer: camera.ImageSizer, margin: float = 0.02
+) -> t.Tuple[float, float, float, float]:
+    """Find the platform in a calibration image, as a region of interest.
+
+    Takes the brightest large region of the undistorted image to be the platform,
+    and returns its bounding box (shrunk by `margin` on each side)
+    as (left, top, right, bottom) fractions of the frame.
+    """
+    height, width = image.shape[:2]
+    map1, map2 = camera.undistortion_maps(
+        (width, height), sizer.matrix_at((width, height)), sizer.dist_coeffs
+    )
+    undistorted = cv2.remap(image, map1, map2, interpolation=cv2.INTER_LINEAR)
+    if undistorted.ndim == 3:
+        undistorted = cv2.cvtColor(undistorted, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.blur(undistorted, (15, 15))
+    _, bright = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(
+        bright, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE
+    )
+    if not contours:
+        return (0.0, 0.0, 1.0, 1.0)
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    return (
+        round(min(x / width + margin, 1.0), 3),
+        round(min(y / height + margin, 1.0), 3),
+        round(max((x + w) / width - margin, 0.0), 3),
+        round(max((y + h) / height - margin, 0.0), 3),
+    )
+
+
+def set_config_roi(
+    roi: t.Sequence[float], path: str = "config.toml", section: str = "camera"
+) -> None:
+    """Rewrite the roi key of a config section in place.
+
+    Edits only that line, so comments and layout of the file are kept.
+    """
+    with open(path, "rt", encoding="utf-8") as file:
+        lines = file.read().split("\n")
+    current = None
+    for index, line in enumerate(lines):
+        header = re.match(r"\s*\[([^\]]+)\]", line)
+        if header:
+            current = header.group(1).strip()
+        elif current == section and re.match(r"\s*roi\s*=", line):
+            lines[index] = f"roi = [{', '.join(str(value) for value in roi)}]"
+            break
+    else:
+        raise KeyError(f"No roi key in [{section}] of {path}")
+    with open(path, "wt", encoding="utf-8") as file:
+        file.write("\n".join(lines))
+
+
+def cmd(arguments: t.Optional[t.Sequence[str]] = None) -> None:
+    """Run argparse and command-line functionality."""
+    parser = argparse.ArgumentParser(description="Calibrate the under camera.")
+    parser.add_argument(
+        "mode",
+        choices=("parameters", "batch", "roi"),
+        help="Calculate camera parameters from saved corners,"
+        " or from a directory of chessboard images,"
+        " or set the platform region of interest from an image.",
+    )
+    parser.add_argument(
+        "--amount", type=int, default=0, help="Number of saved corner arrays to use."
+    )
+    parser.add_argument(
+        "--image", default="images/image0.jpg", help="Image of the empty platform."
+    )
+    parser.add_argument("--config", default="config.toml", help="Config to update.")
+    parser.add_argument(
+        "--images", default="images", help="Directory of chessboard images."
+    )
+    parser.add_argument(
+        "--processes", type=int, help="Processes to search images with."
+    )
+
+    args = parser.parse_args(arguments)
+
+    if args.mode == "parameters":
+        calculate_parameters(BOARD_WIDTH, BOARD_HEIGHT, args.amount)
+    elif args.mode == "batch":
+        calculate_parameters_batch(
+            args.images, BOARD_WIDTH, BOARD_HEIGHT, args.processes
+        )
+    elif args.mode == "roi":
+        roi = platform_roi(cv2.imread(args.image), camera.configured_sizer())
+        set_config_roi(roi, path=args.config)
+        print(f"Set roi to {roi}")
 
 
 if __name__ == "__main__":
-    BOARD_WIDTH = 7
-    BOARD_HEIGHT = 5
-    calculate_parameters(BOARD_WIDTH, BOARD_HEIGHT, int(sys.argv[1]))
+    cmd()
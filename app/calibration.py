@@ -0,0 +1,267 @@
+"""Calibration bundle of the under camera: one binary file loaded at startup.
+
+The bundle is an uncompressed .npz holding the camera matrix
+and distortion coefficients, the resolution they were calibrated at,
+the pixels per centimeter on the platform at that resolution,
+and full frame undistortion maps for the configured capture resolutions.
+
+Arrays are memory mapped straight out of the file, so loading it
+parses nothing and builds no maps; pages are read as they are used.
+
+If there is no bundle, one is built from the legacy text matrices
+(cameraMatrix.txt, cameraScaleMatrix.txt and cameraDistortionMatrix.txt).
+"""
+
+import logging
+import os
+import typing as t
+import zipfile
+
+import numpy
+
+from . import camera
+from . import config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Bumped whenever the contents of bundles change, so old ones are migrated
+BUNDLE_VERSION = 1
+
+# Pair of undistortion maps for cv2.remap, as from camera.undistortion_maps
+Maps = t.Tuple[numpy.ndarray, numpy.ndarray]
+
+
+class BundleVersionError(ValueError):
+    """A calibration bundle is of another version than this code writes."""
+
+    def __init__(self, path: str, version: int) -> None:
+        """Construct a new BundleVersionError for the bundle at `path`."""
+        super().__init__(
+            f"Calibration bundle {path} is version {version},"
+            f" expected {BUNDLE_VERSION}."
+        )
+        self.version = version
+
+
+class Calibration(t.NamedTuple):
+    """Contents of a calibration bundle."""
+
+    # Camera matrix and distortion coefficients, as from cv2.calibrateCamera
+    cam_matrix: numpy.ndarray
+    dist_coeffs: numpy.ndarray
+    # (width, height) the camera was calibrated at
+    resolution: t.Tuple[int, int]
+    # Pixels per centimeter on the platform, at the calibrated resolution
+    pixels_per_cm: float
+    # Full frame undistortion maps, by (width, height)
+    maps: t.Mapping[t.Tuple[int, int], Maps]
+
+
+def build(
+    cam_matrix: numpy.ndarray,
+    dist_coeffs: numpy.ndarray,
+    resolution: t.Tuple[int, int],
+    pixels_per_cm: float,
+    map_resolutions: t.Iterable[t.Tuple[int, int]] = (),
+) -> Calibration:
+    """Construct a Calibration, building maps for each of `map_resolutions`."""
+    sizer = camera.ImageSizer(cam_matrix, dist_coeffs, resolution=resolution)
+    maps: t.Dict[t.Tuple[int, int], Maps] = {}
+    for width, height in map_resolutions:
+        size = (width, height)
+        maps[size] = camera.undistortion_maps(size, sizer.matrix_at(size), dist_coeffs)
+    return Calibration(cam_matrix, dist_coeffs, resolution, pixels_per_cm, maps)
+
+
+def save(calibration: Calibration, path: str) -> None:
+    """Write a calibration bundle.
+
+    Written uncompressed (so it can be memory mapped) to a temporary file,
+    then moved over `path`.
+    """
+    # Any, as numpy.savez also takes keyword options
+    arrays: t.Dict[str, t.Any] = {
+        "version": numpy.array(BUNDLE_VERSION),
+        "cam_matrix": calibration.cam_matrix,
+        "dist_coeffs": calibration.dist_coeffs,
+        "resolution": numpy.array(calibration.resolution),
+        "pixels_per_cm": numpy.array(calibration.pixels_per_cm),
+    }
+    for (width, height), (map1, map2) in calibration.maps.items():
+        arrays[f"map1_{width}x{height}"] = map1
+        arrays[f"map2_{width}x{height}"] = map2
+    temporary = f"{path}.tmp.npz"
+    numpy.savez(temporary, **arrays)
+    os.replace(temporary, path)
+    logger.info("Saved calibration bundle %s", path)
+
+
+def load_arrays(path: str) -> t.Dict[str, numpy.ndarray]:
+    """Memory map every array in an uncompressed .npz file, by name.
+
+    Compressed members can't be mapped, so are read instead.
+    """
+    arrays = {}
+    with open(path, "rb") as file, zipfile.ZipFile(file) as archive:
+        for info in archive.infolist():
+            name = info.filename[: -len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = numpy.lib.format.read_array(member)
+                continue
+            # The member's data follows its local header, whose extra field
+            # may differ in length from the one in the central directory
+            file.seek(info.header_offset)
+            header = file.read(30)
+            start = (
+                info.header_offset
+                + 30
+                + int.from_bytes(header[26:28], "little")
+                + int.from_bytes(header[28:30], "little")
+            )
+            file.seek(start)
+            read_header = {
+                (1, 0): numpy.lib.format.read_array_header_1_0,
+                (2, 0): numpy.lib.format.read_array_header_2_0,
+            }.get(numpy.lib.format.read_magic(file))
+            mappable = read_header is not None
+            if read_header is not None:
+                shape, fortran_order, dtype = read_header(file)
+                # Scalars and empty arrays have nothing worth mapping
+                mappable = bool(shape) and 0 not in shape and not dtype.hasobject
+            if not mappable:
+                file.seek(start)
+                arrays[name] = numpy.lib.format.read_array(file)
+                continue
+            arrays[name] = numpy.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=file.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load(path: str) -> Calibration:
+    """Load a calibration bundle, memory mapping its maps."""
+    arrays = load_arrays(path)
+    version = int(arrays["version"])
+    if version != BUNDLE_VERSION:
+        raise BundleVersionError(path, version)
+    maps = {}
+    for name in arrays:
+        if name.startswith("map1_"):
+            size = name[len("map1_") :]
+            width, height = (int(x) for x in size.split("x"))
+            maps[(width, height)] = (arrays[name], arrays[f"map2_{size}"])
+    width, height = (int(x) for x in arrays["resolution"])
+    return Calibration(
+        # Small enough to copy out, so they can be used like any other array
+        cam_matrix=numpy.array(arrays["cam_matrix"]),
+        dist_coeffs=numpy.array(arrays["dist_coeffs"]),
+        resolution=(width, height),
+        pixels_per_cm=float(arrays["pixels_per_cm"]),
+        maps=maps,
+    )
+
+
+def from_legacy() -> Calibration:
+    """Build a Calibration from the legacy text matrices named in config.
+
+    They are taken to be at the configured calibration resolution,
+    with the long standing pixels per centimeter.
+    """
+    camera_matrix = numpy.loadtxt(
+        config.process.cameraMatrix, dtype="float", delimiter=","
+    )
+    scale_matrix = numpy.loadtxt(
+        config.process.cameraScaleMatrix, dtype="float", delimiter=","
+    )
+    camera_matrix *= scale_matrix
+    distortion_matrix = numpy.loadtxt(
+        config.process.cameraDistortionMatrix, dtype="float", delimiter=","
+    )
+    width, height = config.camera.calibration_resolution
+    return build(
+        camera_matrix,
+        distortion_matrix,
+        (width, height),
+        camera.ImageSizer.pixels_per_cm,
+        map_resolutions(),
+    )
+
+
+def map_resolutions() -> t.List[t.Tuple[int, int]]:
+    """Resolutions frames are captured at, so bundles carry maps for them."""
+    return [
+        (width, height)
+        for width, height in (
+            config.camera.preview_resolution,
+            config.camera.resolution,
+        )
+    ]
+
+
+def migrate(path: str) -> Calibration:
+    """Rebuild an older calibration bundle from its own calibration.
+
+    Only the maps are built again; the calibration itself is kept.
+    """
+    arrays = load_arrays(path)
+    width, height = (int(x) for x in arrays["resolution"])
+    return build(
+        numpy.array(arrays["cam_matrix"]),
+        numpy.array(arrays["dist_coeffs"]),
+        (width, height),
+        float(arrays["pixels_per_cm"]),
+        map_resolutions(),
+    )
+
+
+def configured() -> Calibration:
+    """Load the configured calibration bundle.
+
+    If there is none, one is built from the legacy text matrices,
+    and an older one is migrated; either is saved,
+    so later startups can load it directly.
+
+    A bundle that can't be read (or is newer than this code) is never
+    replaced: the legacy matrices are used, but not saved over it.
+    """
+    path = config.process.cameraCalibration
+    try:
+        return load(path)
+    except FileNotFoundError:
+        logger.info("No calibration bundle %s, building one", path)
+        calibration = from_legacy()
+    except BundleVersionError as e:
+        if e.version > BUNDLE_VERSION:
+            logger.error("%s Using the legacy matrices instead", e)
+            return from_legacy()
+        logger.warning("%s Migrating it", e)
+        try:
+            calibration = migrate(path)
+        except (KeyError, ValueError, zipfile.BadZipFile) as e:
+            logger.error(
+                "Could not migrate calibration bundle %s, using the legacy"
+                " matrices instead: %s",
+                path,
+                e,
+            )
+            return from_legacy()
+    except (KeyError, ValueError, zipfile.BadZipFile) as e:
+        logger.error(
+            "Could not read calibration bundle %s, using the legacy"
+            " matrices instead: %s",
+            path,
+            e,
+        )
+        return from_legacy()
+    try:
+        save(calibration, path)
+    except OSError as e:
+        logger.warning("Could not save calibration bundle: %s", e)
+    return calibration
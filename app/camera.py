@@ -1,18 +1,25 @@
 """Handles video collection and processing"""
 
+import argparse
+import collections
 import dataclasses
 import itertools
 import logging
+import math
+import os
+import sys
 import threading
 import time
 import typing as t
 
 import cv2
 import numpy
-import picamera
-from picamera.array import PiRGBArray
 
 from . import config
+from . import timing
+
+if t.TYPE_CHECKING:
+    from . import sources
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -46,7 +53,16 @@ def crosshair(
 
     Note the actual line thickness is doubled.
     """
-    image = image.copy()
+    return draw_crosshair(image.copy(), radius, thickness, colour)
+
+
+def draw_crosshair(
+    image: Image, radius: int, thickness: int, colour: t.Tuple[int, int, int]
+) -> Image:
+    """Draw a crosshair onto the provided image, in place.
+
+    Returns the same image, see crosshair.
+    """
     # print(image.shape)
     row_mid = (image.shape[0] // 2) - 1
     column_mid = (image.shape[1] // 2) - 1
@@ -67,6 +83,396 @@ def crosshair(
     return image
 
 
+class BufferPool:
+    """Reusable image buffers, to avoid allocating new arrays for every frame.
+
+    A buffer handed out by .take is only handed out again
+    once nothing else references it (or any view of it),
+    so results that hold on to buffers, e.g. in a ResultCache, stay valid.
+    """
+
+    def __init__(self, limit: int) -> None:
+        """Construct a new BufferPool.
+
+        At most `limit` buffers are kept for each shape and type;
+        past that, .take allocates arrays that are not reused.
+        """
+        self.limit = limit
+        self.buffers: t.Dict[
+            t.Tuple[t.Tuple[int, ...], numpy.dtype], t.List[numpy.ndarray]
+        ] = {}
+        self.lock = threading.Lock()
+        # Reference count of a buffer nobody else holds, as seen by ._references
+        self.free_references = self._references([numpy.empty(0)], 0)
+
+    @staticmethod
+    def _references(buffers: t.List[numpy.ndarray], index: int) -> int:
+        """Count the references to a pooled buffer."""
+        buffer = buffers[index]
+        return sys.getrefcount(buffer)
+
+    def take(self, shape: t.Sequence[int], dtype: t.Any = numpy.uint8) -> numpy.ndarray:
+        """Get an unused buffer of the given shape and type.
+
+        Contents of the buffer are undefined.
+        """
+        key = (tuple(shape), numpy.dtype(dtype))
+        with self.lock:
+            buffers = self.buffers.setdefault(key, [])
+            for index in range(len(buffers)):
+                if self._references(buffers, index) <= self.free_references:
+                    return buffers[index]
+            buffer = numpy.empty(shape, dtype=dtype)
+            if len(buffers) < self.limit:
+                buffers.append(buffer)
+            return buffer
+
+
+# Number of undistortion map pairs kept around by undistortion_maps
+UNDISTORT_CACHE_SIZE = 4
+
+_undistort_maps: t.OrderedDict[t.Hashable, t.Tuple[numpy.ndarray, numpy.ndarray]] = (
+    collections.OrderedDict()
+)
+_undistort_lock = threading.Lock()
+
+
+# Pixel region of an image: (x, y, width, height)
+Region = t.Tuple[int, int, int, int]
+
+
+def undistortion_maps(
+    resolution: t.Tuple[int, int],
+    cam_matrix: numpy.ndarray,
+    dist_coeffs: numpy.ndarray,
+    roi: t.Optional[Region] = None,
+) -> t.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Get remap tables that undistort images of the given (width, height).
+
+    Building the tables evaluates the full distortion model for every pixel,
+    so they are built once per (resolution, camera matrix, distortion coefficients)
+    and kept in a small least recently used cache.
+
+    If a region of interest (in undistorted pixels) is given,
+    the tables only cover that region, so remapping with them
+    produces just the region and skips every pixel outside of it.
+
+    The maps are in fixed-point (CV_16SC2) form, which cv2.remap handles fastest.
+    """
+    key = (
+        tuple(resolution),
+        cam_matrix.tobytes(),
+        dist_coeffs.tobytes(),
+        None if roi is None else tuple(roi),
+    )
+    with _undistort_lock:
+        maps = _undistort_maps.get(key)
+        if maps is not None:
+            _undistort_maps.move_to_end(key)
+            return maps
+
+    # Build outside of the lock; at worst two threads build the same tables once
+    if roi is None:
+        newCamMatrix, _ = cv2.getOptimalNewCameraMatrix(
+            cam_matrix, dist_coeffs, imageSize=tuple(resolution), alpha=0
+        )
+        maps = cv2.initUndistortRectifyMap(
+            cam_matrix, dist_coeffs, None, newCamMatrix, tuple(resolution), cv2.CV_16SC2
+        )
+        logger.debug("Built undistortion maps for %s", resolution)
+    else:
+        x, y, width, height = roi
+        map1, map2 = undistortion_maps(resolution, cam_matrix, dist_coeffs)
+        # Contiguous copies of the submatrices, so remap can run straight over them
+        maps = (
+            numpy.ascontiguousarray(map1[y : y + height, x : x + width]),
+            numpy.ascontiguousarray(map2[y : y + height, x : x + width]),
+        )
+
+    with _undistort_lock:
+        _undistort_maps[key] = maps
+        while len(_undistort_maps) > UNDISTORT_CACHE_SIZE:
+            _undistort_maps.popitem(last=False)
+    return maps
+
+
+def seed_undistortion_maps(
+    resolution: t.Tuple[int, int],
+    cam_matrix: numpy.ndarray,
+    dist_coeffs: numpy.ndarray,
+    maps: t.Tuple[numpy.ndarray, numpy.ndarray],
+) -> None:
+    """Provide prebuilt full frame maps for undistortion_maps to use.
+
+    E.g. maps saved in a calibration bundle, so they are never built at runtime.
+    """
+    key = (tuple(resolution), cam_matrix.tobytes(), dist_coeffs.tobytes(), None)
+    with _undistort_lock:
+        _undistort_maps[key] = maps
+        while len(_undistort_maps) > UNDISTORT_CACHE_SIZE:
+            _undistort_maps.popitem(last=False)
+
+
+def region_of(fractions: t.Sequence[float], resolution: t.Tuple[int, int]) -> Region:
+    """Convert a (left, top, right, bottom) fractional region to pixels.
+
+    Fractions are of the given (width, height) resolution,
+    and the region is clamped to lie within it.
+    """
+    width, height = resolution
+    left = min(max(int(round(fractions[0] * width)), 0), width - 1)
+    top = min(max(int(round(fractions[1] * height)), 0), height - 1)
+    right = min(max(int(round(fractions[2] * width)), left + 1), width)
+    bottom = min(max(int(round(fractions[3] * height)), top + 1), height)
+    return (left, top, right - left, bottom - top)
+
+
+def merge_regions(regions: t.Iterable[Region]) -> t.List[Region]:
+    """Merge overlapping pixel regions into their bounding regions.
+
+    The returned regions do not overlap each other.
+    """
+    merged: t.List[Region] = []
+    for region in regions:
+        x, y, width, height = region
+        # Absorb every merged region this one overlaps, growing it as we go
+        overlapped = True
+        while overlapped:
+            overlapped = False
+            for index, (ox, oy, owidth, oheight) in enumerate(merged):
+                if (
+                    x < ox + owidth
+                    and ox < x + width
+                    and y < oy + oheight
+                    and oy < y + height
+                ):
+                    right = max(x + width, ox + owidth)
+                    bottom = max(y + height, oy + oheight)
+                    x, y = min(x, ox), min(y, oy)
+                    width, height = right - x, bottom - y
+                    del merged[index]
+                    overlapped = True
+                    break
+        merged.append((x, y, width, height))
+    return merged
+
+
+# Number of frames whose intermediate stage results are kept,
+# for processors measuring the same frame one after another
+CONTEXT_CACHE_SIZE = 2
+
+
+@dataclasses.dataclass(frozen=True)
+class Stage:
+    """A named step of processing a frame, as part of a graph of stages.
+
+    `compute` is given the FrameContext and the results of each input stage.
+
+    Stages compare by name, inputs and parameters (not by `compute`),
+    so equal stages declared by different processors
+    are computed only once for each frame.
+    """
+
+    name: str
+    compute: t.Callable[..., t.Any] = dataclasses.field(compare=False, repr=False)
+    inputs: t.Tuple["Stage", ...] = ()
+    params: t.Hashable = ()
+
+
+class FrameContext:
+    """Results of the stages run on a single frame.
+
+    Each stage is computed at most once, the first time it is run,
+    so processors sharing a context share any intermediate images.
+    """
+
+    def __init__(
+        self,
+        source: Image,
+        buffers: t.Optional[BufferPool] = None,
+        timer: t.Optional[t.Callable[[str, float], None]] = None,
+    ) -> None:
+        """Construct a new FrameContext for the source image.
+
+        Stages write into `buffers` where they can;
+        without a pool every result is newly allocated.
+
+        If given, `timer` is called with the name and duration (in seconds)
+        of each stage computed, excluding its inputs
+        and any other stages it runs itself.
+        """
+        self.source = source
+        self.buffers = buffers if buffers is not None else BufferPool(0)
+        self.timer = timer
+        self.results: t.Dict[Stage, t.Any] = {}
+        # Reentrant, as stages run their inputs
+        self.lock = threading.RLock()
+        # Seconds spent in stages run by the stage being timed
+        self.nested = 0.0
+
+    def run(self, stage: Stage) -> t.Any:
+        """Get the result of the stage, computing it (and its inputs) if needed."""
+        with self.lock:
+            if stage not in self.results:
+                if self.timer is None:
+                    inputs = [self.run(input) for input in stage.inputs]
+                    self.results[stage] = stage.compute(self, *inputs)
+                else:
+                    self.results[stage] = self._timed(stage, self.timer)
+            return self.results[stage]
+
+    def _timed(self, stage: Stage, timer: t.Callable[[str, float], None]) -> t.Any:
+        """Compute the stage, timing only its own work."""
+        begin = time.perf_counter()
+        outer = self.nested
+        try:
+            inputs = [self.run(input) for input in stage.inputs]
+            self.nested = 0.0
+            start = time.perf_counter()
+            result = stage.compute(self, *inputs)
+            timer(stage.name, time.perf_counter() - start - self.nested)
+        finally:
+            # Whatever ran this stage excludes all of its time, inputs included
+            self.nested = outer + time.perf_counter() - begin
+        return result
+
+
+# Graph root, the frame as captured
+SOURCE = Stage("source", lambda context: context.source)
+
+
+def gray(image: Stage) -> Stage:
+    """Monoscale stage.
+
+    Single channel (e.g. luma) images are already monoscale.
+    """
+
+    def compute(context: FrameContext, image: Image) -> Image:
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(
+            image, cv2.COLOR_BGR2GRAY, dst=context.buffers.take(image.shape[:2])
+        )
+
+    return Stage("gray", compute, (image,))
+
+
+def blurred(image: Stage, size: int = 5) -> Stage:
+    """Box blur stage."""
+
+    def compute(context: FrameContext, image: Image) -> Image:
+        return cv2.blur(image, (size, size), dst=context.buffers.take(image.shape))
+
+    return Stage("blur", compute, (image,), params=size)
+
+
+def thresholded(image: Stage, upper: int = 0) -> Stage:
+    """Grayscale thresholding stage, marking pixels darker than `upper`.
+
+    Expects a single channel grayscale image.
+    """
+
+    def compute(context: FrameContext, image: Image) -> Image:
+        _, thresh_output = cv2.threshold(
+            image,
+            upper,
+            255,
+            cv2.THRESH_BINARY_INV,
+            dst=context.buffers.take(image.shape),
+        )
+        return thresh_output
+
+    return Stage("threshold", compute, (image,), params=upper)
+
+
+def contours(mask: Stage, levels: int = 0, min_size: int = 1) -> Stage:
+    """External contour stage, skipping any too small to fit a `min_size` square.
+
+    With `levels`, candidate objects are first found on a pyramid level
+    sampling every 2**levels pixels. Sampling rather than averaging costs next
+    to nothing, and with samples at most `min_size` / sqrt(2) apart,
+    no object large enough to keep (at any rotation) falls between them.
+
+    The samples are only seeds: the whole full resolution object touching
+    each is filled from it, so thin parts (e.g. leads) that fall between
+    samples are still traced, and only the filled objects are traced.
+    """
+
+    def contours_of(image: Image, offset: t.Tuple[int, int] = (0, 0)) -> t.Any:
+        """Find contours, shifted by offset (e.g. of a subregion)."""
+        found, _ = cv2.findContours(
+            image,
+            mode=cv2.RETR_EXTERNAL,
+            method=cv2.CHAIN_APPROX_SIMPLE,
+            offset=offset,
+        )
+        return found
+
+    def candidate_objects(
+        context: FrameContext, image: Image
+    ) -> t.Tuple[Image, t.List[Region]]:
+        """Mask of just the objects seeded by the samples, and regions holding them.
+
+        The mask has a 1 pixel border, as cv2.floodFill requires;
+        regions are in the coordinates of the image.
+        """
+        # Any min_size square, however rotated, holds a disc of that diameter,
+        # which always covers a sample of a grid of this pitch
+        factor = min(2**levels, max(1, int(min_size / math.sqrt(2))))
+        height, width = image.shape[:2]
+        samples = image[::factor, ::factor]
+        coarse = context.buffers.take(samples.shape)
+        numpy.copyto(coarse, samples)
+        filled = context.buffers.take((height + 2, width + 2))
+        filled.fill(0)
+        regions: t.List[Region] = []
+        for contour in contours_of(coarse):
+            x, y, w, h = cv2.boundingRect(contour)
+            # Too small to hold an object, even allowing for the lost detail
+            if (w + 1) * (h + 1) * factor**2 < min_size**2:
+                continue
+            # Any point of the contour is a sample on the object
+            seed_x, seed_y = (int(value) * factor for value in contour[0][0])
+            if filled[seed_y + 1, seed_x + 1]:
+                # Already filled from another seed
+                continue
+            # Fill the 8-connected object, as findContours traces them
+            _, _, _, (x, y, w, h) = cv2.floodFill(
+                image,
+                filled,
+                (seed_x, seed_y),
+                0,
+                flags=8 | cv2.FLOODFILL_MASK_ONLY | (255 << 8),
+            )
+            regions.append((x, y, w, h))
+        return (filled, merge_regions(regions))
+
+    def compute(context: FrameContext, image: Image) -> t.List[numpy.ndarray]:
+        if levels > 0:
+            filled, regions = candidate_objects(context, image)
+            # Objects lie wholly within the regions, and each in just one
+            found = [
+                contour
+                for x, y, width, height in regions
+                for contour in contours_of(
+                    filled[y + 1 : y + height + 1, x + 1 : x + width + 1],
+                    offset=(x, y),
+                )
+            ]
+        else:
+            found = contours_of(image)
+        kept = []
+        for contour in found:
+            # A rotated rect is never larger than the upright bounding rect,
+            # so this cheaply skips specks before any rect fitting
+            _, _, width, height = cv2.boundingRect(contour)
+            if width * height >= min_size**2:
+                kept.append(contour)
+        return kept
+
+    return Stage("contours", compute, (mask,), params=(levels, min_size))
+
+
 class ImageProcessor:
     """Abstract class for objects capable of transforming an image."""
 
@@ -74,8 +480,41 @@ class ImageProcessor:
         """Performs no processing, base method."""
         return (source, None)
 
+    def measure_frame(self, source: Image, **options: t.Any) -> t.Any:
+        """Process the image without rendering an output image.
 
-@dataclasses.dataclass()
+        The returned measurement can later be rendered by .annotate_frame.
+
+        Base implementation does the full processing,
+        so that annotating it is free.
+        """
+        return self.process_frame(source, **options)
+
+    def measure_context(self, context: FrameContext, **options: t.Any) -> t.Any:
+        """Measure the frame of the context, as .measure_frame.
+
+        Processors built from stages override this to run them on the context,
+        sharing their results with other processors of the same frame.
+        """
+        return self.measure_frame(context.source, **options)
+
+    def annotate_frame(self, measurement: t.Any) -> t.Tuple[Image, t.Any]:
+        """Render a measurement from .measure_frame, as returned by .process_frame.
+
+        Base implementation expects the measurement to already be rendered.
+        """
+        return measurement
+
+    def calibrate_background(self, images: t.Iterable[Image]) -> None:
+        """Learn the empty scene from the given frames of it.
+
+        Base implementation has no background to learn.
+        """
+        raise NotImplementedError(f"{type(self).__name__} has no background model.")
+
+
+# Processors compare by identity (eq=False) so they can key cached results
+@dataclasses.dataclass(eq=False)
 class ChessboardFinder(ImageProcessor):
     """Looks for an processes a chessboard."""
 
@@ -86,13 +525,25 @@ class ChessboardFinder(ImageProcessor):
         self, source: Image, **options: t.Any
     ) -> t.Tuple[Image, t.Tuple[numpy.ndarray, bytes]]:
         """Searchs for chessboard."""
+        return self.measure_context(FrameContext(source), **options)
+
+    def measure_context(
+        self, context: FrameContext, **options: t.Any
+    ) -> t.Tuple[Image, t.Tuple[numpy.ndarray, bytes]]:
+        """Searchs for chessboard, in the shared monoscale frame."""
 
         ret, corners = cv2.findChessboardCorners(
-            source, (self.points_height, self.points_width)
+            context.run(gray(SOURCE)), (self.points_height, self.points_width)
         )
         # ret, corners = True, []
 
-        output = source
+        output = context.source
+        # Draw in colour, even on grayscale frames,
+        # leaving the frame untouched for other processors
+        if output.ndim == 2:
+            output = cv2.cvtColor(output, cv2.COLOR_GRAY2BGR)
+        else:
+            output = output.copy()
 
         if not ret:
             logger.debug("Failed")
@@ -108,7 +559,222 @@ class ChessboardFinder(ImageProcessor):
         return (output, (corners, encoding))
 
 
-@dataclasses.dataclass()
+# Rotated rect, as from cv2.minAreaRect: ((x, y), (width, height), angle)
+Rect = t.Tuple[t.Tuple[float, float], t.Tuple[float, float], float]
+
+
+class BackgroundModel:
+    """Incrementally updated model of the empty platform, for segmentation.
+
+    Objects are whatever differs from the model by more than `tolerance`,
+    after compensating for the overall brightness of the frame.
+    Pixels matching the model are blended into it at `rate`,
+    so it follows slow lighting changes.
+
+    The model is of prepared (undistorted, monoscale and blurred) images
+    of the region of interest `roi` of frames captured at `resolution`.
+    It is only used for other images of that same area, resized if they are
+    of another resolution (e.g. the preview); a model of any other area,
+    e.g. after the region of interest changed, is not used at all.
+    """
+
+    # Fraction of an image that must match the model for it to be learned;
+    # anything else (e.g. lights on, or the platform covered) is ignored
+    MIN_BACKGROUND: float = 0.5
+    # Largest relative difference in aspect ratio of images
+    # taken to be of the same area as the model
+    ASPECT_TOLERANCE: float = 0.02
+
+    def __init__(
+        self,
+        tolerance: float,
+        rate: float,
+        path: t.Optional[str] = None,
+        roi: t.Sequence[float] = (0.0, 0.0, 1.0, 1.0),
+        resolution: t.Optional[t.Tuple[int, int]] = None,
+    ) -> None:
+        """Construct a new BackgroundModel.
+
+        A model previously calibrated to `path` is loaded, if there is one
+        and it was calibrated on the given `roi` of frames of the given
+        (width, height) `resolution`.
+        """
+        self.tolerance = tolerance
+        self.rate = rate
+        self.path = path
+        self.roi = tuple(roi)
+        self.resolution = resolution
+        self.lock = threading.Lock()
+        # Model as calibrated, and the running model for each image shape
+        self.base: t.Optional[numpy.ndarray] = None
+        self.models: t.Dict[t.Tuple[int, ...], numpy.ndarray] = {}
+        # Background of the last learned image of each shape,
+        # which the brightness of the next image is measured over
+        self.masks: t.Dict[t.Tuple[int, ...], numpy.ndarray] = {}
+        # Image shapes found not to be of the model's area
+        self.mismatched: t.Set[t.Tuple[int, ...]] = set()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path: str) -> None:
+        """Load a calibrated model, if it is of the configured area."""
+        saved = numpy.load(path)
+        if not isinstance(saved, numpy.lib.npyio.NpzFile) or "roi" not in saved:
+            logger.warning(
+                "Background model %s does not record its region, recalibrate it",
+                path,
+            )
+            return
+        with saved:
+            roi = tuple(float(x) for x in saved["roi"])
+            width, height = (int(x) for x in saved["resolution"])
+            if roi != self.roi or (
+                self.resolution is not None and (width, height) != self.resolution
+            ):
+                logger.warning(
+                    "Background model %s is of region %s of %s frames,"
+                    " not region %s of %s frames, recalibrate it",
+                    path,
+                    roi,
+                    (width, height),
+                    self.roi,
+                    self.resolution,
+                )
+                return
+            self.base = saved["model"]
+        logger.info("Loaded background model %s", path)
+
+    @property
+    def calibrated(self) -> bool:
+        """Whether there is a model to segment with."""
+        return self.base is not None
+
+    def calibrate(
+        self,
+        images: t.Iterable[Image],
+        roi: t.Sequence[float],
+        resolution: t.Tuple[int, int],
+    ) -> None:
+        """Replace the model with the average of prepared images of the empty platform.
+
+        The images are of the region `roi` of frames of (width, height)
+        `resolution`, which are saved with the model to .path, if there is one.
+        """
+        total: t.Optional[numpy.ndarray] = None
+        count = 0
+        for image in images:
+            if total is None:
+                total = numpy.zeros(image.shape, dtype=numpy.float32)
+            cv2.accumulate(image, total)
+            count += 1
+        if total is None:
+            raise ValueError("No images to calibrate the background with.")
+        total /= count
+        with self.lock:
+            self.base = total
+            self.roi = tuple(roi)
+            self.resolution = resolution
+            self.models = {}
+            self.masks = {}
+            self.mismatched = set()
+        if self.path is not None:
+            # Through a file, so numpy keeps the configured name as it is
+            with open(self.path, "wb") as file:
+                numpy.savez(
+                    file,
+                    model=total,
+                    roi=numpy.array(self.roi),
+                    resolution=numpy.array(resolution),
+                )
+            logger.info("Saved background model %s", self.path)
+
+    def _model_for(self, shape: t.Tuple[int, ...]) -> t.Optional[numpy.ndarray]:
+        """Running model for images of the given shape.
+
+        None if images of that shape can't be of the model's area.
+        Must be called while holding the lock, once calibrated.
+        """
+        model = self.models.get(shape)
+        if model is None and shape not in self.mismatched:
+            assert self.base is not None
+            height, width = self.base.shape[:2]
+            if self.base.shape == shape:
+                model = self.base.copy()
+            elif (
+                abs(shape[1] * height / (shape[0] * width) - 1) > self.ASPECT_TOLERANCE
+            ):
+                logger.warning(
+                    "Background model is of %dx%d images, not usable for %dx%d",
+                    width,
+                    height,
+                    shape[1],
+                    shape[0],
+                )
+                self.mismatched.add(shape)
+                return None
+            else:
+                model = cv2.resize(
+                    self.base, (shape[1], shape[0]), interpolation=cv2.INTER_AREA
+                )
+            self.models[shape] = model
+        return model
+
+    def segment(self, image: Image, buffers: BufferPool) -> t.Optional[Image]:
+        """Mask the pixels of the image that differ from the background.
+
+        Expects a single channel prepared image.
+        Returns None if the model is not calibrated, or not of the image's area.
+
+        Learns the pixels that match the background into the model.
+        """
+        shape = image.shape
+        with self.lock:
+            if self.base is None:
+                return None
+            model = self._model_for(shape)
+            if model is None:
+                return None
+
+            # Scale the model to the brightness of the image,
+            # measured over what was background last time
+            background = self.masks.get(shape)
+            expected = cv2.mean(model, mask=background)[0]
+            gain = cv2.mean(image, mask=background)[0] / expected if expected else 1.0
+            reference = cv2.convertScaleAbs(model, alpha=gain, dst=buffers.take(shape))
+            difference = cv2.absdiff(image, reference, dst=reference)
+            _, mask = cv2.threshold(
+                difference,
+                self.tolerance,
+                255,
+                cv2.THRESH_BINARY,
+                dst=buffers.take(shape),
+            )
+
+            if background is None:
+                background = numpy.empty(shape, dtype=numpy.uint8)
+            cv2.bitwise_not(mask, dst=background)
+            if cv2.countNonZero(background) >= self.MIN_BACKGROUND * background.size:
+                self.masks[shape] = background
+                cv2.accumulateWeighted(image, model, self.rate, mask=background)
+            else:
+                self.masks.pop(shape, None)
+        return mask
+
+
+class Sizing(t.NamedTuple):
+    """Geometry found by ImageSizer.measure_frame."""
+
+    # Undistorted region of interest the geometry was found on
+    view: Image
+    # Single channel image, nonzero where an object was seen
+    mask: Image
+    # Rotated bounding rects of the objects
+    rects: t.Sequence[Rect]
+    # Scaled (width, height) of each rect
+    sizes: t.Sequence[t.Tuple[float, float]]
+
+
+@dataclasses.dataclass(eq=False)
 class ImageSizer(ImageProcessor):
     """Handles processing a raw image.
 
@@ -118,10 +784,40 @@ class ImageSizer(ImageProcessor):
     cam_matrix: numpy.ndarray
     dist_coeffs: numpy.ndarray
 
+    # Region of the (undistorted) frame that is processed,
+    # as fractions of the frame: left, top, right, bottom
+    roi: t.Sequence[float] = (0.0, 0.0, 1.0, 1.0)
+
+    # (width, height) the camera matrix and pixel scale were calibrated at;
+    # frames of other resolutions are handled by scaling both
+    resolution: t.Tuple[int, int] = (320, 240)
+
+    # Pixels per centimeter on the platform, at the calibrated resolution
+    pixels_per_cm: float = 115 / 13
+
+    # Number of times the mask is halved to search for candidate objects,
+    # which are then only traced at full resolution; 0 traces the whole mask
+    pyramid_levels: int = 0
+
+    # Model of the empty platform to segment against;
+    # without a calibrated one the threshold option is used
+    background: t.Optional[BackgroundModel] = None
+
+    # Work buffers reused between frames; enough for every cached measurement
+    # and annotation to hold on to its own, plus a few in flight
+    buffers: BufferPool = dataclasses.field(
+        default_factory=lambda: BufferPool(2 * config.camera.result_cache + 4),
+        repr=False,
+    )
+
     def rect_to_size(
-        self, rect: t.Tuple[object, t.Tuple[float, float], object]
+        self, rect: t.Tuple[object, t.Tuple[float, float], object], scale: float = 1
     ) -> t.Tuple[float, float]:
-        """Convert a rotated bounding rect to a scaled size."""
+        """Convert a rotated bounding rect to a scaled size.
+
+        `scale` is the size of the frame the rect was found in,
+        relative to the calibrated resolution.
+        """
         # Pixel (corrected) to inches:
         # Sticky pad size:
         # 1 & 15/16 Inches = 1.9375 in
@@ -131,8 +827,115 @@ class ImageSizer(ImageProcessor):
         # pixels_per_centimeter = 1
         # pixels_per_centimeter = 85/8.255  # TODO approximate measure, should also look at arcuro?
         # PIXELS_PER_CENTIMETER = 82 / 8.255
-        PIXELS_PER_CENTIMETER = 115 / 13
-        return (rect[1][0] / PIXELS_PER_CENTIMETER, rect[1][1] / PIXELS_PER_CENTIMETER)
+        pixels_per_cm = self.pixels_per_cm * scale
+        return (rect[1][0] / pixels_per_cm, rect[1][1] / pixels_per_cm)
+
+    def scale_of(self, image: Image) -> float:
+        """Size of the image relative to the calibrated resolution."""
+        return image.shape[1] / self.resolution[0]
+
+    def matrix_for(self, image: Image) -> numpy.ndarray:
+        """Camera matrix scaled to the resolution of the image."""
+        return self.matrix_at((image.shape[1], image.shape[0]))
+
+    def matrix_at(self, resolution: t.Tuple[int, int]) -> numpy.ndarray:
+        """Camera matrix scaled to the given (width, height)."""
+        scale = resolution[0] / self.resolution[0]
+        if scale == 1:
+            return self.cam_matrix
+        matrix = self.cam_matrix.copy()
+        # Focal lengths and principal point scale with the image
+        matrix[:2] *= scale
+        return matrix
+
+    def undistort(self, image: Image, buffers: t.Optional[BufferPool] = None) -> Image:
+        """Correct distortion of the image, keeping only the region of interest.
+
+        Pixels outside of the region are never computed.
+        """
+        map1, map2 = undistortion_maps(
+            (image.shape[1], image.shape[0]),
+            self.matrix_for(image),
+            self.dist_coeffs,
+            roi=region_of(self.roi, (image.shape[1], image.shape[0])),
+        )
+        buffers = buffers if buffers is not None else self.buffers
+        return cv2.remap(
+            image,
+            map1,
+            map2,
+            interpolation=cv2.INTER_LINEAR,
+            dst=buffers.take(map1.shape[:2] + image.shape[2:], image.dtype),
+        )
+
+    # Stages, see Stage
+    # pipeline:
+    # undistort and crop to region of interest
+    # monoscale
+    # deskew (or after blur?)
+    # blur
+    # segment (background difference, or threshold)
+    # find contours
+
+    @property
+    def undistorted(self) -> Stage:
+        """Stage undistorting the frame to the region of interest."""
+        return Stage(
+            "undistort",
+            lambda context, image: self.undistort(image, context.buffers),
+            (SOURCE,),
+            params=(
+                self.cam_matrix.tobytes(),
+                self.dist_coeffs.tobytes(),
+                tuple(self.roi),
+                tuple(self.resolution),
+            ),
+        )
+
+    @property
+    def blurred(self) -> Stage:
+        """Stage giving the blurred monoscale region of interest."""
+        return blurred(gray(self.undistorted))
+
+    def segmented(self, threshold: int) -> Stage:
+        """Stage masking objects, against the background model if calibrated.
+
+        Otherwise pixels darker than the threshold are taken as objects.
+        """
+        blur = self.blurred
+
+        def compute(context: FrameContext, image: Image) -> Image:
+            mask = None
+            if self.background is not None:
+                mask = self.background.segment(image, context.buffers)
+            if mask is None:
+                mask = context.run(thresholded(blur, threshold))
+            return mask
+
+        return Stage("segment", compute, (blur,), params=(self.background, threshold))
+
+    def prepare(self, source: Image) -> t.Tuple[Image, Image]:
+        """Undistort, monoscale and blur the source image.
+
+        Returns the undistorted region of interest, for drawing on,
+        and the blurred single channel image that is segmented.
+        """
+        context = FrameContext(source, self.buffers)
+        return context.run(self.undistorted), context.run(self.blurred)
+
+    def calibrate_background(self, images: t.Iterable[Image]) -> None:
+        """Calibrate the background model from frames of the empty platform."""
+        if self.background is None:
+            raise ValueError("ImageSizer has no background model.")
+        images = list(images)
+        if not images:
+            raise ValueError("No images to calibrate the background with.")
+        height, width = images[0].shape[:2]
+        # Each prepared image is accumulated before the next is prepared,
+        # so the pooled buffers need no copying
+        self.background.calibrate(
+            (self.prepare(image)[1] for image in images), self.roi, (width, height)
+        )
 
     def process_frame(
         self, source: Image, **options: t.Any
@@ -142,134 +945,97 @@ class ImageSizer(ImageProcessor):
 
         Returns the highlighted image and the width and height of the bounding box.
         """
+        return self.annotate_frame(self.measure_frame(source, **options))
 
-        # list of sizes of contour boxes
-        sizes = []
-
-        # pipeline:
-        # crop (?)
-        # copy for output
-        # monoscale
-        # deskew (or after blur?)
-        # blur
-        # filter (hsv)
-        # find contours
-
-        def corrected(image: Image) -> Image:
-            """Correct distortion of the image."""
-            # roi: region of interest
-            newCamMatrix, roi = cv2.getOptimalNewCameraMatrix(
-                self.cam_matrix,
-                self.dist_coeffs,
-                imageSize=(image.shape[1], image.shape[0]),
-                alpha=0,
-            )
-            undistorted = cv2.undistort(
-                image, self.cam_matrix, self.dist_coeffs, newCameraMatrix=newCamMatrix
-            )
-            # undistorted = cv2.undistort(image, self.cam_matrix, self.dist_coeffs)
-            # x, y, width, height = roi
-            # print(roi)
-            # return undistorted[y:y+height, x:x+width]
-            return undistorted
-
-        def cropped(image: Image) -> Image:
-            """Crop step"""
-            leftMargin = 0
-            rightMargin = 0  # 30
-            topMargin = 0
-            bottomMargin = 0
-            return image[
-                topMargin : (image.shape[0] - bottomMargin),
-                leftMargin : (image.shape[1] - rightMargin),
-            ].copy()
-
-        def monoconvert(image: Image) -> Image:
-            """Applies monoscale step"""
-            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        def blurred(image: Image) -> Image:
-            """Applies blur step"""
-            return cv2.blur(image, (5, 5))
-
-        def thresholded(image: Image, upper: int = 0) -> Image:
-            """Apply grayscale thresholding step.
-
-            Expects single channel grayscale image.
-            """
-            _, thresh_output = cv2.threshold(image, upper, 255, cv2.THRESH_BINARY_INV)
-            return thresh_output
-
-        def contours_of(image: Image) -> numpy.ndarray:
-            """Contour finding step.
-
-            Expects single channel Image.
-            """
-            contours, _ = cv2.findContours(
-                image, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE
-            )
-            # print(contours)
-            return contours
-
-        corrected_image = corrected(source)
-        # corrected_image = source #, need to recalibrate
-        # can also probably scale cam properties by resolution scale
-        # find what default resolution was and scale to the max
-        cropped_image = cropped(corrected_image)
-        mono = monoconvert(cropped_image)
-        blur = blurred(mono)
-        # blur = cv2.cvtColor(blur, cv2.COLOR_GRAY2BGR)
-        # filtered = hsv_filtered(blur)
-        filtered = thresholded(blur, options["threshold"])
-        contours = contours_of(filtered)
+    def measure_frame(self, source: Image, **options: t.Any) -> Sizing:
+        """Search the given source image for bounding boxes.
 
-        # output = cv2.cvtColor(filtered, cv2.COLOR_GRAY2BGR)
-        # output = cv2.cvtColor(blur, cv2.COLOR_GRAY2BGR)
-        # output = corrected_image
-        output = cropped_image.copy()
-        overlay = numpy.zeros(output.shape, dtype=numpy.uint8)
-        overlay[filtered > 0] = config.camera.colours.red
-        # output[filtered > 0] = red
-        output = cv2.addWeighted(output, 0.9, overlay, 0.1, gamma=0)
+        Only finds the geometry, without any drawing or output copies.
+        Intermediate images are written into reused buffers,
+        which the returned Sizing keeps hold of.
+        """
+        return self.measure_context(FrameContext(source, self.buffers), **options)
 
-        # Parse contours
+    def measure_context(self, context: FrameContext, **options: t.Any) -> Sizing:
+        """Search the frame of the context for bounding boxes, as .measure_frame."""
         MIN_SIZE = 10
-        for contour in contours:
+        mask = self.segmented(options["threshold"])
+        found = context.run(
+            contours(mask, levels=self.pyramid_levels, min_size=MIN_SIZE)
+        )
+
+        # Parse contours
+        rects = []
+        for contour in found:
             # flatrect =cv2.boundingRect(contour)
             # https://docs.opencv.org/3.1.0/dd/d49/tutorial_py_contour_features.html
             rect = cv2.minAreaRect(contour)
 
             if rect[1][0] >= MIN_SIZE and rect[1][1] >= MIN_SIZE:
-                # print(rect)
-                box = numpy.int0(cv2.boxPoints(rect))
-
-                highlight_color = config.camera.colours.blue
-                highlight_thickness = config.camera.thickness
-                text_color = config.camera.colours.green
-                cv2.drawContours(output, [box], 0, highlight_color, highlight_thickness)
-                cv2.putText(
-                    output,
-                    text="({0:.{prec}f}, {1:.{prec}f})".format(
-                        *self.rect_to_size(rect), prec=2
-                    ),
-                    org=tuple(map(int, rect[0])),
-                    fontFace=cv2.FONT_HERSHEY_PLAIN,
-                    fontScale=1.0,
-                    color=text_color,
-                    thickness=1,
-                )
+                rects.append(rect)
+
+        return Sizing(
+            view=context.run(self.undistorted),
+            mask=context.run(mask),
+            rects=rects,
+            sizes=[
+                self.rect_to_size(rect, self.scale_of(context.source)) for rect in rects
+            ],
+        )
 
-                sizes.append(self.rect_to_size(rect))
+    def annotate_frame(
+        self, measurement: Sizing
+    ) -> t.Tuple[Image, t.Sequence[t.Tuple[float, float]]]:
+        """Draw the geometry found by .measure_frame over the image it was found on.
 
-        output = crosshair(
+        Returns the highlighted image and the width and height of the bounding box.
+        """
+        view = measurement.view
+        # Colour is only needed for drawing, so convert grayscale frames here
+        if view.ndim == 2:
+            view = cv2.cvtColor(
+                view, cv2.COLOR_GRAY2BGR, dst=self.buffers.take(view.shape + (3,))
+            )
+        # output = cv2.cvtColor(filtered, cv2.COLOR_GRAY2BGR)
+        # output = cv2.cvtColor(blur, cv2.COLOR_GRAY2BGR)
+        # output = corrected_image
+        # Overlay is red wherever the mask is set, built in place
+        overlay = self.buffers.take(view.shape)
+        overlay.fill(0)
+        cv2.add(
+            overlay, (*config.camera.colours.red, 0), dst=overlay, mask=measurement.mask
+        )
+        # output[filtered > 0] = red
+        output = cv2.addWeighted(
+            view, 0.9, overlay, 0.1, gamma=0, dst=self.buffers.take(view.shape)
+        )
+        # Drop the overlay so its buffer can be reused straight away
+        del overlay
+
+        highlight_color = config.camera.colours.blue
+        highlight_thickness = config.camera.thickness
+        text_color = config.camera.colours.green
+        for rect, size in zip(measurement.rects, measurement.sizes):
+            box = numpy.intp(cv2.boxPoints(rect))
+
+            cv2.drawContours(output, [box], 0, highlight_color, highlight_thickness)
+            cv2.putText(
+                output,
+                text="({0:.{prec}f}, {1:.{prec}f})".format(*size, prec=2),
+                org=tuple(map(int, rect[0])),
+                fontFace=cv2.FONT_HERSHEY_PLAIN,
+                fontScale=1.0,
+                color=text_color,
+                thickness=1,
+            )
+
+        output = draw_crosshair(
             output,
             radius=config.camera.crosshair.radius,
             thickness=config.camera.crosshair.thickness,
             colour=config.camera.colours.gray,
         )
 
-        # print(sizes)
-
         display = output
         # display = source
 
@@ -277,15 +1043,132 @@ class ImageSizer(ImageProcessor):
         # back[: output.shape[0], : output.shape[1]] = output
         # display = scale(numpy.concatenate((source, back), axis=1), factor=1)
 
-        return (display, sizes)
+        return (display, measurement.sizes)
+
+
+def configured_sizer() -> ImageSizer:
+    """Construct the ImageSizer described by config, with its calibration.
 
+    Undistortion maps saved with the calibration are used as they are.
+    """
+    # Imported here, as calibration imports this module
+    from . import calibration
+
+    bundle = calibration.configured()
+    width, height = config.camera.resolution
+    sizer = ImageSizer(
+        cam_matrix=bundle.cam_matrix,
+        dist_coeffs=bundle.dist_coeffs,
+        roi=config.camera.roi,
+        resolution=bundle.resolution,
+        pixels_per_cm=bundle.pixels_per_cm,
+        pyramid_levels=config.camera.pyramid_levels,
+        background=BackgroundModel(
+            tolerance=config.camera.background.tolerance,
+            rate=config.camera.background.rate,
+            path=config.process.cameraBackground,
+            roi=config.camera.roi,
+            resolution=(width, height),
+        ),
+    )
+    for resolution, maps in bundle.maps.items():
+        seed_undistortion_maps(
+            resolution, sizer.matrix_at(resolution), sizer.dist_coeffs, maps
+        )
+    return sizer
+
+
+class ResultCache(t.Generic[T]):
+    """Small least recently used cache of processing results.
+
+    If a result is requested while another thread is already computing it,
+    waits for that computation instead of repeating it.
+    """
+
+    def __init__(self, size: int) -> None:
+        """Construct a cache holding at most `size` results."""
+        self.size = size
+        self.results: t.OrderedDict[t.Hashable, T] = collections.OrderedDict()
+        self.pending: t.Dict[t.Hashable, threading.Event] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: t.Hashable, compute: t.Callable[[], T]) -> T:
+        """Get the result for the key, calling compute if it is not cached."""
+        while True:
+            with self.lock:
+                if key in self.results:
+                    self.results.move_to_end(key)
+                    return self.results[key]
+                event = self.pending.get(key)
+                if event is None:
+                    # Nobody is computing this result, so we claim it
+                    event = self.pending[key] = threading.Event()
+                    break
+            # Wait for the other computation, then check again;
+            # if it failed we will end up claiming the key ourselves
+            event.wait()
+
+        try:
+            result = compute()
+        finally:
+            with self.lock:
+                del self.pending[key]
+                event.set()
+        with self.lock:
+            self.results[key] = result
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+        return result
+
+
+class SceneGate:
+    """Decides whether a frame shows the same scene as an earlier frame.
+
+    Compares heavily downscaled copies of the frames,
+    which is cheap next to processing a full frame.
+    """
+
+    def __init__(self, scale: float, tolerance: float) -> None:
+        """Construct a new SceneGate.
+
+        Frames are downscaled by `scale` before comparing,
+        and are the same scene if no downscaled pixel differs by more than `tolerance`.
+        A negative tolerance disables the gate.
+        """
+        self.scale = scale
+        self.tolerance = tolerance
+
+    def thumbnail(self, image: Image) -> Image:
+        """Downscale an image for comparison."""
+        return scale(image, factor=self.scale)
+
+    def same(self, first: Image, second: Image) -> bool:
+        """Determine if two thumbnails show the same scene."""
+        if self.tolerance < 0 or first.shape != second.shape:
+            return False
+        return cv2.norm(first, second, cv2.NORM_INF) <= self.tolerance
+
+
+class Frame(t.NamedTuple):
+    """A single frame captured by the camera thread."""
+
+    image: Image
+    # Monotonically increasing count of captured frames
+    sequence: int
+    # time.time() at which the frame was captured
+    timestamp: float
+    # Estimated time.time() at which exposure of the frame began;
+    # errs early (see sources.exposure_latency), so anything before it
+    # definitely happened before exposure
+    started: float
+
+
+def default_source() -> "sources.FrameSource":
+    """Open the frame source selected by config, see sources.configured."""
+    # Imported here, as sources imports this module
+    from . import sources
 
-def open_camera() -> picamera.PiCamera:
-    """Open a properly configured PiCamera."""
-    resolution = (320, 240)
-    # resolution = (640, 480)
-    # framerate = 32
-    return picamera.PiCamera(resolution=resolution)
+    return sources.configured()
 
 
 class Camera:
@@ -295,85 +1178,307 @@ class Camera:
     IDLE_TIME: int = 10
 
     thread: t.Optional[threading.Thread] = None
-    frame: t.Optional[Image] = None
+    # Why the last thread stopped without capturing a frame, e.g. no camera
+    error: t.Optional[BaseException] = None
+    frame: t.Optional[Frame] = None
+    sequence: int = 0
     last_request: float = 0
 
-    @classmethod
-    def read_camera(cls) -> None:
-        # Open camera in context manager for proper cleanup
-        with open_camera() as camera:
-            logger.info("Started PiCamera")
-
-            # Wait for camera to warm up
-            WARMUP_TIME = 2  # seconds
-            # camera.start_preview()
-            time.sleep(WARMUP_TIME)
-
-            # Create PiRGBArray for cam output
-            capture = PiRGBArray(camera)
-
-            # Create a generator that will output into capture
-            # on each iteration
-            generator = camera.capture_continuous(
-                capture, format="bgr", use_video_port=True
-            )
+    # Most recent frames, oldest first, to find frames taken after an event
+    frames: t.Deque[Frame] = collections.deque(maxlen=config.camera.ring_size)
+
+    # Buffers captured frames are written into, enough for the ring of
+    # recent frames, the frames of cached contexts, and a few in use elsewhere
+    frame_buffers = BufferPool(config.camera.ring_size + CONTEXT_CACHE_SIZE + 4)
+
+    # Opens the source of frames each time the thread starts,
+    # e.g. replace with a sources.ReplaySource to run away from the Pi
+    source_factory: t.Callable[[], "sources.FrameSource"] = staticmethod(default_source)
+    # Open source while the thread runs, used to capture full resolution stills
+    source: t.Optional["sources.FrameSource"] = None
+    still_lock = threading.Lock()
+
+    # Guards the class attributes above,
+    # and is notified whenever a new frame is captured or the thread stops
+    condition = threading.Condition()
+
+    # Processing results shared by all instances,
+    # keyed by (frame sequence, processor, options).
+    # Measurements are kept seperately from their annotated images,
+    # which are only rendered when someone asks for them.
+    measurements: ResultCache[t.Any] = ResultCache(config.camera.result_cache)
+    annotations: ResultCache[t.Tuple[Image, t.Any]] = ResultCache(
+        config.camera.result_cache
+    )
+    jpgs: ResultCache[bytes] = ResultCache(config.camera.result_cache)
 
-            # We don't actually use the output of the generator
-            for _ in generator:
-                # Extract the numpy frame
-                cls.frame = capture.array.copy()
-                # logger.debug("Inside generator: %s", cls.frame)
-                # Truncate so capture can be reused
-                capture.truncate(0)
-                # Break once there are no clients, stopping the thread
-                if time.time() - cls.last_request > cls.IDLE_TIME:
-                    break
+    # Stage results of recent frames, keyed by frame sequence,
+    # so different processors of a frame compute each stage once.
+    # Their buffers are kept by measurements as well as contexts.
+    contexts: ResultCache[FrameContext] = ResultCache(CONTEXT_CACHE_SIZE)
+    buffers = BufferPool(2 * config.camera.result_cache + 4 * CONTEXT_CACHE_SIZE)
+
+    # Frames of a static scene reuse the results of the frame the scene was
+    # first seen in; that frame is tracked for each way of processing frames
+    gate = SceneGate(config.camera.gate.scale, config.camera.gate.tolerance)
+    thumbnails: ResultCache[Image] = ResultCache(config.camera.result_cache)
+    scenes: t.Dict[t.Hashable, t.Tuple[Image, int]] = {}
+    scenes_lock = threading.Lock()
 
-        logger.info("Closed PiCamera.")
-        # Remove this thread object from the class once it finishes
-        cls.thread = None
+    @classmethod
+    def read_camera(cls) -> None:
+        error: t.Optional[BaseException] = None
+        captured = False
+        try:
+            # Open source in context manager for proper cleanup
+            with cls.source_factory() as source:
+                cls.source = source
+                preview = tuple(config.camera.preview_resolution)
+                for image, timestamp, started in source.frames(
+                    preview, cls.frame_buffers
+                ):
+                    with cls.condition:
+                        cls.sequence += 1
+                        cls.frame = Frame(image, cls.sequence, timestamp, started)
+                        cls.frames.append(cls.frame)
+                        cls.condition.notify_all()
+                    captured = True
+                    # Break once there are no clients, stopping the thread
+                    if time.time() - cls.last_request > cls.IDLE_TIME:
+                        break
+            if not captured:
+                error = RuntimeError("Camera gave no frames.")
+        except Exception as e:
+            logger.exception("Camera thread failed")
+            error = e
+        finally:
+            with cls.condition:
+                # Remove this thread object from the class once it finishes,
+                # and drop the stale frame so a restart waits for a fresh one
+                cls.thread = None
+                # Only a failure to start is reported to waiters;
+                # a thread that stops later is simply started again
+                cls.error = None if captured else error
+                cls.frame = None
+                cls.frames.clear()
+                cls.source = None
+                cls.condition.notify_all()
 
     @classmethod
     def initialize(cls) -> None:
         """Initialize the camera."""
-        # logger.debug("Inside initialize, thread: %s", cls.thread)
-        # Start thread if it is not running
-        if cls.thread is None:
-            logger.debug("Creating thread")
-            cls.thread = threading.Thread(target=cls.read_camera)
-            cls.thread.start()
-            # Busy wait until a frame is available
-            while cls.frame is None:
-                # Yield control
-                time.sleep(0)
-            # logger.debug("First frame: %s", cls.frame)
+        with cls.condition:
+            # Start thread if it is not running
+            if cls.thread is None:
+                logger.debug("Creating thread")
+                cls.error = None
+                cls.thread = threading.Thread(target=cls.read_camera, daemon=True)
+                cls.thread.start()
 
     @classmethod
-    def get_frame(cls) -> Image:
-        """Get the latest image frame."""
+    def wait_frame(
+        cls,
+        newer_than: int = 0,
+        timeout: t.Optional[float] = None,
+        *,
+        after: t.Optional[float] = None,
+    ) -> Frame:
+        """Get a frame, waiting for one if neccesary.
+
+        Without `after`, gets the latest frame
+        with a sequence number greater than `newer_than`.
+
+        With `after` (as from time.time()), gets the first such frame
+        whose exposure began after that time, e.g. after lights were switched,
+        as soon as it exists.
+
+        The defaults accept any frame, so only wait for the camera to start.
+        If the camera thread stops while waiting, it is started again.
+
+        Raises TimeoutError if no such frame arrives within `timeout` seconds,
+        or RuntimeError (caused by the original error) if the camera
+        fails to start, e.g. if it is missing or busy.
+        """
         cls.last_request = time.time()
-        # logger.debug("Before initialize")
-        cls.initialize()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with cls.condition:
+            cls.initialize()
+            while True:
+                if after is None:
+                    if cls.frame is not None and cls.frame.sequence > newer_than:
+                        return cls.frame
+                else:
+                    for frame in cls.frames:
+                        if frame.sequence > newer_than and frame.started > after:
+                            return frame
+                if cls.thread is None:
+                    if cls.error is not None:
+                        raise RuntimeError("Camera failed to start.") from cls.error
+                    # e.g. it went idle just as we asked, so keep it going
+                    cls.last_request = time.time()
+                    cls.initialize()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No new camera frame.")
+                cls.condition.wait(remaining)
+
+    @classmethod
+    def capture_still(cls, after: t.Optional[float] = None) -> Frame:
+        """Capture a full resolution frame.
+
+        If `after` is given, recaptures until the exposure of the frame
+        began after that time.
+
+        Starts the camera if neccesary.
+        Uses a seperate splitter port, so the preview stream keeps running.
+        """
+        # Ensures the camera is open
+        cls.wait_frame()
+        with cls.still_lock:
+            while True:
+                source = cls.source
+                if source is None:
+                    # The thread stopped since, so start it again
+                    cls.wait_frame()
+                    continue
+                image, timestamp, started = source.still(cls.frame_buffers)
+                if after is None or started > after:
+                    break
+        with cls.condition:
+            # Shares numbering with the preview,
+            # so every frame has a distinct sequence number
+            cls.sequence += 1
+            return Frame(image, cls.sequence, timestamp, started)
 
-        # logger.debug("Inside get_frame: %s", cls.frame)
-        return cls.frame  # type: ignore
+    @classmethod
+    def get_frame(cls) -> Image:
+        """Get the latest image frame."""
+        return cls.wait_frame().image
 
     def __init__(self, processor: ImageProcessor) -> None:
 
         # Save processor ref for use in getting frames
         self.processor = processor
 
-    def get_processed_frame(self, **options: t.Any) -> t.Tuple[Image, t.Any]:
-        """Returns the current frame of the processed video"""
-        raw = type(self).get_frame()
-        # logger.debug("Inside get_processed_frame: %s", raw)
-        result = self.processor.process_frame(raw, **options)
-        # logger.debug("Processed frame")
-        return result
+    def calibrate_background(
+        self, frames: int = 1, after: t.Optional[float] = None
+    ) -> None:
+        """Calibrate the processor's background from full resolution stills.
 
-    def get_jpg(self, **options: t.Any) -> bytes:
-        """Returns the current frame, encoded as jpg"""
-        return cv2.imencode(".jpg", self.get_processed_frame(**options)[0])[1].tobytes()
+        The stills are taken after `after`, as with .capture_still,
+        so the scene must be empty by then.
+        """
+        stills = []
+        for _ in range(frames):
+            frame = type(self).capture_still(after=after)
+            after = frame.started
+            stills.append(frame.image)
+        self.processor.calibrate_background(stills)
+
+    def get_measurement(
+        self, frame: t.Optional[Frame] = None, **options: t.Any
+    ) -> t.Any:
+        """Returns the measurement of the given frame, or the current frame.
+
+        Skips rendering an output image, see ImageProcessor.measure_frame.
+
+        Results are cached, so asking for a frame that was already measured
+        by the same processor with the same options does not process it again.
+        Processors measuring the same frame share its FrameContext.
+        """
+        if frame is None:
+            frame = type(self).wait_frame()
+        cls = type(self)
+        current = frame
+        return cls.measurements.get(
+            self.result_key(frame, options),
+            timing.timed(
+                "measure",
+                lambda: self.processor.measure_context(
+                    cls.contexts.get(
+                        current.sequence,
+                        lambda: FrameContext(
+                            current.image,
+                            cls.buffers,
+                            timing.record if timing.enabled else None,
+                        ),
+                    ),
+                    **options,
+                ),
+            ),
+        )
+
+    def get_processed_frame(
+        self, frame: t.Optional[Frame] = None, **options: t.Any
+    ) -> t.Tuple[Image, t.Any]:
+        """Returns the given frame, or the current frame, of the processed video.
+
+        Shares the cached measurement with .get_measurement,
+        and caches the rendered result in the same way.
+        """
+        if frame is None:
+            frame = type(self).wait_frame()
+        current = frame
+
+        def annotate() -> t.Tuple[Image, t.Any]:
+            measurement = self.get_measurement(current, **options)
+            return timing.timed(
+                "annotate", lambda: self.processor.annotate_frame(measurement)
+            )()
+
+        return type(self).annotations.get(self.result_key(frame, options), annotate)
+
+    def result_key(
+        self, frame: Frame, options: t.Mapping[str, t.Any]
+    ) -> t.Tuple[int, ImageProcessor, t.Tuple[t.Tuple[str, t.Any], ...]]:
+        """Key identifying the results of processing a frame with some options.
+
+        If the scene has not changed since an earlier frame
+        processed in the same way, the key of that frame is used,
+        so its results are reused instead of processing this frame.
+        """
+        cls = type(self)
+        processing = (self.processor, tuple(sorted(options.items())))
+        image = frame.image
+        thumbnail = cls.thumbnails.get(
+            frame.sequence, lambda: cls.gate.thumbnail(image)
+        )
+        # Frames of different resolutions (e.g. stills) are tracked seperately
+        scene_key = (*processing, image.shape)
+        with cls.scenes_lock:
+            scene = cls.scenes.get(scene_key)
+            if (
+                scene is not None
+                and scene[1] <= frame.sequence
+                and cls.gate.same(scene[0], thumbnail)
+            ):
+                sequence = scene[1]
+            else:
+                sequence = frame.sequence
+                cls.scenes[scene_key] = (thumbnail, sequence)
+        return (sequence, *processing)
+
+    def get_jpg(self, frame: t.Optional[Frame] = None, **options: t.Any) -> bytes:
+        """Returns the given frame, or the current frame, encoded as jpg.
+
+        Encodings are cached like other results.
+        """
+        if frame is None:
+            frame = type(self).wait_frame()
+        current = frame
+
+        def encode() -> bytes:
+            output = self.get_processed_frame(current, **options)[0]
+            return timing.timed(
+                "encode", lambda: cv2.imencode(".jpg", output)[1].tobytes()
+            )()
+
+        return type(self).jpgs.get(self.result_key(frame, options), encode)
+
+    @staticmethod
+    def get_timings() -> t.Dict[str, t.Any]:
+        """Timings of the processing stages, see timing.snapshot."""
+        return timing.snapshot()
 
 
 # https://www.pyimagesearch.com/2019/09/02/opencv-stream-video-to-web-browser-html-page/
@@ -382,17 +1487,64 @@ class Camera:
 
 
 def main() -> None:
-    """Main function"""
-    source = cv2.imread("test.jpg")
+    """Measure frames from a source, e.g. replayed recordings, printing the sizes.
 
-    proc = ImageProcessor()
-    out, result = proc.process_frame(source)
+    Runs the same Camera and ImageSizer used by the web interface,
+    so performance problems can be reproduced away from the Pi.
+    """
+    # Imported here, as sources imports this module
+    from . import sources
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "source",
+        nargs="?",
+        default=config.camera.source,
+        help="directory of images or video file to replay, or picamera",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=config.camera.replay_rate,
+        help="frames replayed per second, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--frames", type=int, default=100, help="number of frames to measure"
+    )
+    parser.add_argument("--threshold", type=int, default=config.web.threshold)
+    parser.add_argument("--show", action="store_true", help="display processed frames")
+    args = parser.parse_args()
 
-    print(result)
+    logging.basicConfig(level=config.logging.level, format=config.logging.format)
 
-    cv2.imshow("output", scale(out, 0.125))
-    cv2.waitKey(60 * 1000)
-    cv2.destroyAllWindows()
+    if args.source != "picamera":
+        Camera.source_factory = lambda: sources.ReplaySource(
+            args.source, rate=args.rate
+        )
+    cam = Camera(processor=configured_sizer())
+
+    start = time.monotonic()
+    sequence = 0
+    for _ in range(args.frames):
+        frame = cam.wait_frame(newer_than=sequence)
+        sequence = frame.sequence
+        if args.show:
+            out, sizes = cam.get_processed_frame(frame, threshold=args.threshold)
+            cv2.imshow("output", out)
+            cv2.waitKey(1)
+        else:
+            sizes = cam.get_measurement(frame, threshold=args.threshold).sizes
+        print(sequence, [tuple(round(float(x), 2) for x in size) for size in sizes])
+    elapsed = time.monotonic() - start
+    print(f"{args.frames} frames in {elapsed:.2f} s ({args.frames / elapsed:.1f} fps)")
+    if args.show:
+        cv2.destroyAllWindows()
+
+    # Let the camera thread stop at its next frame, rather than mid capture
+    thread = Camera.thread
+    Camera.last_request = 0
+    if thread is not None:
+        thread.join()
 
 
 if __name__ == "__main__":
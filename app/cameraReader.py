@@ -7,9 +7,10 @@ import typing as t
 import cv2
 import numpy
 import picamera
-from picamera.array import PiRGBArray
 
+from . import camera as cameras
 from . import reader
+from . import sources
 
 Image = t.Union[numpy.ndarray]
 
@@ -31,7 +32,11 @@ class Camera(reader.ReaderContext[Image]):
 
     def __post_init__(self) -> None:
         """Perform non-dataclass init."""
-        self.capture = PiRGBArray(self.camera)
+        # Frames are written straight into reused buffers,
+        # each free again once whoever read it lets go
+        self.capture = sources.PooledArray(
+            self.camera.resolution, channels=3, buffers=cameras.BufferPool(4)
+        )
         self.generator = self.camera.capture_continuous(
             self.capture, format="bgr", use_video_port=True
         )
@@ -44,8 +49,8 @@ class Camera(reader.ReaderContext[Image]):
         """Read a processed image and values from the camera."""
         next(self.generator)
         # Extract the numpy frame
-        frame = self.capture.array.copy()
+        frame = self.capture.array
         # logger.debug("Inside generator: %s", cls.frame)
-        # Truncate so capture can be reused
+        # Truncate so the next frame goes into a free buffer
         self.capture.truncate(0)
         return frame
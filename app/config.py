@@ -183,14 +183,70 @@ class CrosshairConfig(Config):
     thickness: int
 
 
+class GateConfig(Config):
+    """GateConfig Schema."""
+
+    # Factor frames are downscaled by before comparing
+    scale: float
+    # Largest difference in a downscaled pixel still considered the same scene;
+    # negative to always process every frame
+    tolerance: float
+
+
+class BackgroundConfig(Config):
+    """BackgroundConfig Schema."""
+
+    # Smallest difference from the background model that counts as an object
+    tolerance: float
+    # Weight each background pixel seen is blended into the model with
+    rate: float
+    # Number of frames averaged when calibrating the model
+    frames: int
+
+
 class CameraConfig(Config):
     """CameraConfig Schema."""
 
     colours: ColoursConfig
     crosshair: CrosshairConfig
+    gate: GateConfig
+    background: BackgroundConfig
     precision: int
     thickness: int
 
+    # Number of processed frames to keep for reuse between consumers
+    result_cache: int
+
+    # Processed region of the frame, as fractions: left, top, right, bottom
+    roi: t.Tuple[float, float, float, float]
+
+    # Capture mode, "bgr" or "luma" (grayscale from YUV, with a grayscale stream)
+    capture: str
+
+    # (width, height) of full resolution measurement frames
+    resolution: t.Tuple[int, int]
+    # (width, height) of the live preview stream
+    preview_resolution: t.Tuple[int, int]
+    # (width, height) the legacy camera matrices were calibrated at
+    calibration_resolution: t.Tuple[int, int]
+
+    # Times the mask is halved to find candidate objects before tracing them
+    pyramid_levels: int
+
+    # Where frames come from: "picamera",
+    # or a directory of images or video file to replay
+    source: str
+    # Frames replayed per second, 0 for as fast as possible
+    replay_rate: float
+
+    # Whether capture and processing run in a seperate worker process
+    worker: bool
+
+    # Number of recent frames kept to find frames taken after an event
+    ring_size: int
+    # Seconds added to the estimated latency of frames, see sources
+    exposure_margin: float
+
 
 camera = CameraConfig.from_raw(raw["camera"])
 
@@ -206,6 +262,8 @@ class PathsConfig(Config):
 class ProcessCameraConfig(Config):
 
     wait: int
+    # Seconds for auto exposure to settle after the lights are switched off
+    settle: float
 
 
 class ProcessConfig(Config):
@@ -218,6 +276,8 @@ class ProcessConfig(Config):
     cameraMatrix: str
     cameraScaleMatrix: str
     cameraDistortionMatrix: str
+    cameraCalibration: str
+    cameraBackground: str
 
 
 process = ProcessConfig.from_raw(raw["process"])
@@ -268,6 +328,20 @@ class LoggingConfig(Config):
 logging = LoggingConfig.from_raw(raw["logging"])
 
 
+class TimingConfig(Config):
+    """TimingConfig Schema."""
+
+    # Whether vision pipeline stages are timed
+    enabled: bool
+    # Number of recent durations kept for each stage
+    window: int
+    # Seconds between logging timings, 0 to never log them
+    log_interval: float
+
+
+timing = TimingConfig.from_raw(raw["timing"])
+
+
 class ReadersConfig(Config):
     """ReadersConfig Schema."""
 
@@ -0,0 +1,200 @@
+"""Smaller versions of saved photos, generated once and kept on disk.
+
+Each photo gets a thumbnail and a web sized version, generated in a pool of
+worker threads (OpenCV releases the GIL while decoding and encoding) using
+reduced resolution JPEG decoding.
+
+Derivatives are stored in a DIRECTORY next to the photos, named by the SHA-1
+of the photo's contents. An index there records each photo's size, mtime
+and hash, so an unchanged photo is found with a stat instead of a read.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import typing as t
+
+from . import photo
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Directory beside photos that their derivatives are kept in
+DIRECTORY = ".derivatives"
+INDEX = "index.json"
+
+# Height of each kind of derivative
+HEIGHTS: t.Mapping[str, int] = {
+    "thumbnail": photo.THUMBNAIL_HEIGHT,
+    "web": 1080,
+}
+
+# Threads generating derivatives
+WORKERS = 2
+
+
+def derivative_folder(path: str) -> str:
+    """Folder the derivatives of the photo at `path` are kept in."""
+    return os.path.join(os.path.dirname(path), DIRECTORY)
+
+
+class DerivativeStore:
+    """Generates and serves derivatives of photos.
+
+    Requests for the same photo while it is being generated
+    share the one generation.
+    """
+
+    def __init__(self, workers: int = WORKERS) -> None:
+        """Construct a new DerivativeStore, generating on `workers` threads."""
+        self.workers = workers
+        self.executor: t.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # Reentrant, as a generation can finish (and be forgotten)
+        # while it is being submitted
+        self.lock = threading.RLock()
+        # Generations in progress, by photo path
+        self.pending: t.Dict[str, "concurrent.futures.Future[t.Dict[str, str]]"] = {}
+        # Loaded indexes, by folder
+        self.indexes: t.Dict[str, t.Dict[str, t.Dict[str, t.Any]]] = {}
+
+    def index(self, folder: str) -> t.Dict[str, t.Dict[str, t.Any]]:
+        """Index of a derivative folder: size, mtime and hash by photo name.
+
+        Must be called while holding the lock.
+        """
+        index = self.indexes.get(folder)
+        if index is None:
+            try:
+                with open(os.path.join(folder, INDEX), "r", encoding="utf-8") as file:
+                    index = json.load(file)
+            except (OSError, ValueError):
+                index = {}
+            self.indexes[folder] = index
+        return index
+
+    def save_index(self, folder: str) -> None:
+        """Write a folder's index, replacing the old one whole.
+
+        Must be called while holding the lock.
+        """
+        temporary = os.path.join(folder, f"{INDEX}.tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.indexes[folder], file)
+        os.replace(temporary, os.path.join(folder, INDEX))
+
+    def lookup(self, path: str) -> t.Optional[t.Dict[str, str]]:
+        """Paths of a photo's derivatives by kind, if all are up to date."""
+        stat = os.stat(path)
+        folder = derivative_folder(path)
+        with self.lock:
+            entry = self.index(folder).get(os.path.basename(path))
+        if (
+            entry is None
+            or entry["size"] != stat.st_size
+            or entry["mtime_ns"] != stat.st_mtime_ns
+        ):
+            return None
+        paths = {
+            kind: os.path.join(folder, f"{entry['sha1']}.{kind}.jpg")
+            for kind in HEIGHTS
+        }
+        if not all(os.path.exists(derivative) for derivative in paths.values()):
+            return None
+        return paths
+
+    def generate(
+        self, path: str, seeds: t.Optional[t.Mapping[str, bytes]] = None
+    ) -> t.Dict[str, str]:
+        """Generate any missing derivatives of a photo, returning their paths.
+
+        `seeds` are derivatives already made, e.g. while the photo was
+        in memory, which are saved instead of generated.
+        """
+        stat = os.stat(path)
+        with open(path, "rb") as file:
+            data = file.read()
+        digest = hashlib.sha1(data).hexdigest()
+        folder = derivative_folder(path)
+        os.makedirs(folder, exist_ok=True)
+
+        paths = {}
+        for kind, height in HEIGHTS.items():
+            derivative = os.path.join(folder, f"{digest}.{kind}.jpg")
+            # An identical photo (e.g. a copy) may have them already
+            if not os.path.exists(derivative):
+                encoded = (seeds or {}).get(kind)
+                if encoded is None:
+                    encoded = photo.thumbnail(data, height)
+                temporary = f"{derivative}.tmp"
+                with open(temporary, "wb") as file:
+                    file.write(encoded)
+                os.replace(temporary, derivative)
+            paths[kind] = derivative
+
+        with self.lock:
+            self.index(folder)[os.path.basename(path)] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha1": digest,
+            }
+            self.save_index(folder)
+        logger.debug("Generated derivatives of %s", path)
+        return paths
+
+    def submit(
+        self, path: str, seeds: t.Optional[t.Mapping[str, bytes]] = None
+    ) -> "concurrent.futures.Future[t.Dict[str, str]]":
+        """Make sure a photo's derivatives exist, generating them in the background.
+
+        Returns a future of their paths by kind.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            future = self.pending.get(path)
+            if future is not None:
+                return future
+        try:
+            paths = self.lookup(path)
+        except OSError:
+            # e.g. a missing photo, which generating reports through the future
+            paths = None
+        if paths is not None:
+            future = concurrent.futures.Future()
+            future.set_result(paths)
+            return future
+        with self.lock:
+            future = self.pending.get(path)
+            if future is None:
+                if self.executor is None:
+                    self.executor = concurrent.futures.ThreadPoolExecutor(
+                        self.workers, thread_name_prefix="derivatives"
+                    )
+                future = self.executor.submit(self.generate, path, seeds)
+                self.pending[path] = future
+                future.add_done_callback(lambda _: self.forget(path))
+        return future
+
+    def forget(self, path: str) -> None:
+        """Stop tracking a finished generation."""
+        with self.lock:
+            self.pending.pop(path, None)
+
+    def read_many(self, paths: t.Iterable[str], kind: str) -> t.List[bytes]:
+        """Read one kind of derivative of each photo, generating them in parallel."""
+        futures = [self.submit(path) for path in paths]
+        contents = []
+        for future in futures:
+            with open(future.result()[kind], "rb") as file:
+                contents.append(file.read())
+        return contents
+
+    def read(self, path: str, kind: str) -> bytes:
+        """Read a derivative of a photo, generating it if needed."""
+        return self.read_many([path], kind)[0]
+
+
+# Shared store, so generations in progress are shared by every caller
+store = DerivativeStore()
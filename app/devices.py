@@ -2,7 +2,6 @@
 
 import logging
 
-import numpy
 import serial
 import VL53L1X
 
@@ -12,6 +11,7 @@ from . import measure
 from . import photo
 from . import reader
 from . import scale
+from . import worker
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -20,23 +20,20 @@ logger.addHandler(logging.NullHandler())
 # Camera methods and objects
 
 
-# Load calibration matrices
-camera_matrix = numpy.loadtxt(config.process.cameraMatrix, dtype="float", delimiter=",")
-scale_matrix = numpy.loadtxt(
-    config.process.cameraScaleMatrix, dtype="float", delimiter=","
-)
-camera_matrix *= scale_matrix
-distortion_matrix = numpy.loadtxt(
-    config.process.cameraDistortionMatrix, dtype="float", delimiter=","
-)
+# Single sizer, so that every camera user shares cached processing results
+image_sizer = camera.configured_sizer()
+
+
+# In worker mode, the camera and its processing run in their own process
+vision_worker = worker.VisionWorker() if config.camera.worker else None
 
 
-def get_camera() -> camera.Camera:
+def get_camera() -> worker.AnyCamera:
     """Get the camera."""
+    if vision_worker is not None:
+        return worker.WorkerCamera(vision_worker)
     return camera.Camera(
-        processor=camera.ImageSizer(
-            cam_matrix=camera_matrix, dist_coeffs=distortion_matrix
-        )
+        processor=image_sizer
         # processor=camera.ImageProcessor()
     )
 
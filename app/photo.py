@@ -6,11 +6,14 @@ import dataclasses
 import datetime
 import functools
 import logging
+import os
+import threading
 import typing as t
 
 # note: using gphoto2 requires the user to be in the plugdev group (or root)
 import cv2
 import gphoto2 as gp
+import numpy
 
 # camera = gp.Camera()
 # print(gp.check_result(gp.gp_camera_autodetect()))
@@ -135,25 +138,242 @@ def close_camera(camera) -> None:
 def config_value(camera, key: str) -> str:
     """Retrieve the value of the requested config key of the provided camera.
 
+    Reads just that key where the camera driver allows,
+    rather than downloading the camera's whole config tree.
+
     Example keys:
     'serialnumber',
     'cameramodel',
     """
-    return gp.check_result(
-        gp.gp_widget_get_child_by_name(camera.get_config(), key)
-    ).get_value()
+    try:
+        widget = camera.get_single_config(key)
+    except (AttributeError, gp.GPhoto2Error):
+        # Older gphoto2, or a driver without single config access
+        widget = gp.check_result(
+            gp.gp_widget_get_child_by_name(camera.get_config(), key)
+        )
+    return widget.get_value()
 
 
-def capture_image(camera, destination: str) -> None:
-    """Capture and download an image from the given camera."""
-    # trigger camera?
-    summary = camera.get_summary()
+# sysfs directory with an entry for every connected USB device
+USB_DEVICES = "/sys/bus/usb/devices"
+
+
+def usb_signature() -> t.Optional[t.FrozenSet[t.Tuple[str, str]]]:
+    """Fingerprint of the connected USB devices, which changes when any come or go.
+
+    Pairs of each device's sysfs name and device number,
+    as a device plugged back in gets a new number.
+    None if it can't be read (e.g. not on Linux).
+    """
+    try:
+        names = os.listdir(USB_DEVICES)
+    except OSError:
+        return None
+    devices = set()
+    for name in names:
+        try:
+            with open(os.path.join(USB_DEVICES, name, "devnum")) as file:
+                devices.add((name, file.read().strip()))
+        except OSError:
+            # Interfaces of devices have no device number
+            pass
+    return frozenset(devices)
+
+
+class CameraInfo(t.NamedTuple):
+    """Identity of a connected photo camera."""
+
+    port: str
+    serial: str
+    model: str
+    # Set name from config.photo.names (e.g. 'overhead', 'side', etc)
+    name: str
+
+
+class CameraRegistry:
+    """Caches which ports cameras are on, and who each camera is.
+
+    Detecting cameras and reading their config means PTP requests
+    to every camera, so both are only redone when the USB devices change.
+    """
+
+    def __init__(self) -> None:
+        """Construct an empty CameraRegistry."""
+        self.lock = threading.Lock()
+        self.signature: t.Optional[t.FrozenSet[t.Tuple[str, str]]] = None
+        self.port_paths: t.Optional[t.Sequence[str]] = None
+        self.infos: t.Dict[str, CameraInfo] = {}
+
+    def ports(self) -> t.Sequence[str]:
+        """Port paths of connected cameras, detected again if USB devices changed."""
+        signature = usb_signature()
+        with self.lock:
+            if (
+                self.port_paths is None
+                or signature is None
+                or signature != self.signature
+            ):
+                self.port_paths = get_camera_ports()
+                self.signature = signature
+                # Port paths include the device number, so a reconnected
+                # camera is on a new path and its old entry is dropped
+                self.infos = {
+                    port: info
+                    for port, info in self.infos.items()
+                    if port in self.port_paths
+                }
+                logger.info("Detected cameras on %s", self.port_paths)
+            return self.port_paths
+
+    def info(self, port_path: str, camera: gp.camera.Camera) -> CameraInfo:
+        """Identity of the camera opened on the port, read once per connection."""
+        with self.lock:
+            info = self.infos.get(port_path)
+        if info is None:
+            serialnumber = config_value(camera, "serialnumber")
+            info = CameraInfo(
+                port=port_path,
+                serial=serialnumber,
+                model=config_value(camera, "cameramodel"),
+                name=config.photo.names.get(serialnumber, config.photo.default_name),
+            )
+            with self.lock:
+                self.infos[port_path] = info
+        return info
 
+
+def download_image(camera) -> bytes:
+    """Capture an image on the given camera and download it into memory."""
     path_on_camera = camera.capture(gp.GP_CAPTURE_IMAGE)
     camera_file = camera.file_get(
         path_on_camera.folder, path_on_camera.name, gp.GP_FILE_TYPE_NORMAL
     )
-    camera_file.save(destination)
+    return bytes(memoryview(camera_file.get_data_and_size()))
+
+
+def capture_image(camera, destination: str) -> None:
+    """Capture and download an image from the given camera."""
+    data = download_image(camera)
+    with open(destination, "wb") as file:
+        file.write(data)
+
+
+# EXIF tag giving how an image should be turned to display it upright
+ORIENTATION_TAG = 0x0112
+
+# EXIF orientation after also turning the image by 180 degrees, by orientation
+HALF_TURNED = {1: 3, 3: 1, 2: 4, 4: 2, 5: 7, 7: 5, 6: 8, 8: 6}
+
+
+def jpeg_segments(data: bytes) -> t.Iterator[t.Tuple[int, int, int]]:
+    """Yield (marker, start, length) of each header segment of a JPEG.
+
+    `start` is the offset of the segment's contents, after its length field.
+    Stops at the start of the compressed image data, or anything malformed.
+    """
+    if data[:2] != b"\xff\xd8":
+        return
+    position = 2
+    while position + 4 <= len(data) and data[position] == 0xFF:
+        marker = data[position + 1]
+        if marker in (0xD9, 0xDA):
+            # End of image, or start of scan
+            return
+        length = int.from_bytes(data[position + 2 : position + 4], "big")
+        yield (marker, position + 4, length - 2)
+        position += 2 + length
+
+
+def jpeg_size(data: bytes) -> t.Optional[t.Tuple[int, int]]:
+    """(width, height) of a JPEG as stored, read from its header."""
+    for marker, start, _ in jpeg_segments(data):
+        # Start of frame markers, other than DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[start + 1 : start + 3], "big")
+            width = int.from_bytes(data[start + 3 : start + 5], "big")
+            return (width, height)
+    return None
+
+
+def orientation_offset(data: bytes) -> t.Optional[t.Tuple[int, str]]:
+    """Find the EXIF orientation of a JPEG, as (offset of the value, byte order)."""
+    for marker, start, length in jpeg_segments(data):
+        if marker != 0xE1 or data[start : start + 6] != b"Exif\x00\x00":
+            continue
+        tiff = start + 6
+        order = "little" if data[tiff : tiff + 2] == b"II" else "big"
+        ifd = tiff + int.from_bytes(data[tiff + 4 : tiff + 8], order)
+        count = int.from_bytes(data[ifd : ifd + 2], order)
+        for index in range(count):
+            entry = ifd + 2 + 12 * index
+            if entry + 12 > start + length:
+                break
+            if int.from_bytes(data[entry : entry + 2], order) == ORIENTATION_TAG:
+                # A single SHORT, stored in the entry's value field
+                return (entry + 8, order)
+        return None
+    return None
+
+
+def turn_half(data: bytes) -> bytes:
+    """Turn a JPEG by 180 degrees.
+
+    Done losslessly by changing its EXIF orientation,
+    which viewers (and cv2.imread) apply when showing it.
+    Only if it has none is the image decoded, turned and encoded again.
+    """
+    found = orientation_offset(data)
+    if found is not None:
+        offset, order = found
+        orientation = int.from_bytes(data[offset : offset + 2], order)
+        if orientation in HALF_TURNED:
+            turned = bytearray(data)
+            turned[offset : offset + 2] = HALF_TURNED[orientation].to_bytes(2, order)
+            return bytes(turned)
+    logger.warning("No EXIF orientation to set, turning by re-encoding")
+    image = cv2.imdecode(numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_COLOR)
+    return cv2.imencode(".jpg", cv2.flip(image, -1))[1].tobytes()
+
+
+# Height of photos sent to the web interface
+THUMBNAIL_HEIGHT = 300
+
+# Flags decoding JPEGs at a fraction of their size, by that fraction
+REDUCED_READS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def decode_reduced(data: bytes, height: int) -> numpy.ndarray:
+    """Decode a JPEG at the smallest fraction of its size still `height` high.
+
+    Reduced decoding skips most of the work of decoding at full size.
+    """
+    flags = cv2.IMREAD_COLOR
+    size = jpeg_size(data)
+    if size is not None:
+        # The shorter side, in case EXIF orientation turns the image on its side
+        shortest = min(size)
+        for factor, reduced in REDUCED_READS.items():
+            if shortest / factor >= height:
+                flags = reduced
+                break
+    return cv2.imdecode(numpy.frombuffer(data, numpy.uint8), flags)
+
+
+def thumbnail(data: bytes, height: int = THUMBNAIL_HEIGHT) -> bytes:
+    """Scale an encoded image to the given height, as a JPEG."""
+    image = decode_reduced(data, height)
+    image = cv2.resize(
+        image,
+        # dsize is (width, height), but .shape is (rows, columns)
+        dsize=(int(image.shape[1] / image.shape[0] * height), height),
+        interpolation=cv2.INTER_AREA,
+    )
+    return cv2.imencode(".jpg", image)[1].tobytes()
 
 
 def capture_image_set(
@@ -193,11 +413,20 @@ def capture_image_set(
     return file_names
 
 
+class Photo(t.NamedTuple):
+    """A photo saved from a camera."""
+
+    path: str
+    # Smaller JPEG of it, for display
+    thumbnail: bytes
+
+
 @dataclasses.dataclass()
 class PhotoCamera(reader.SelfContext):
     """Class wrapping a gphoto2-type photo camera."""
 
     camera: gp.camera.Camera
+    info: CameraInfo
 
     def close(self) -> None:
         logger.info("Closing camera %s", self.camera)
@@ -211,15 +440,15 @@ def capture_photo_image(
     use_timestamp: bool = True,
     timestamp: t.Optional[datetime.datetime] = None,
     format: str = None,
-) -> str:
+) -> Photo:
     """Capture and download an image from the given camera.
 
-    Uses the serial number of the camera and the config table
-    to determine a path name, which is then returned.
-    """
-    serialnumber = config_value(camera.camera, "serialnumber")
+    Uses the set name of the camera to determine a path name.
 
-    name = config.photo.names.get(serialnumber, config.photo.default_name)
+    The image is downloaded into memory, turned (if neccesary)
+    and scaled down for a thumbnail there, then written once.
+    """
+    name = camera.info.name
     # Construct filename as a string to give to gphoto
     save_path = files.data_name(
         name=name,
@@ -231,15 +460,16 @@ def capture_photo_image(
         timestamp=timestamp,
     )
 
-    capture_image(camera.camera, save_path)
+    data = download_image(camera.camera)
 
     # Flip image if neccesary
     if name in config.photo.flip:
-        loaded_photo = cv2.imread(save_path)
-        flipped = cv2.flip(loaded_photo, -1)
-        cv2.imwrite(save_path, flipped)
+        data = turn_half(data)
+
+    with open(save_path, "wb") as file:
+        file.write(data)
 
-    return save_path
+    return Photo(save_path, thumbnail(data))
 
 
 class CamerasInterface:
@@ -254,14 +484,16 @@ class CamerasInterface:
     """
 
     def __init__(self, timeout: float) -> None:
-        self.cameras: t.MutableMapping[str, reader.Manager[PhotoCamera, str]] = {}
+        self.cameras: t.MutableMapping[str, reader.Manager[PhotoCamera, Photo]] = {}
         self.timeout = timeout
+        self.registry = CameraRegistry()
 
     def lazy_camera(self, port_path: str) -> t.Callable[[], PhotoCamera]:
         """Return a function that produces a camera on the given port."""
 
         def opener() -> PhotoCamera:
-            return PhotoCamera(open_camera(port_path))
+            camera = open_camera(port_path)
+            return PhotoCamera(camera, self.registry.info(port_path, camera))
 
         return opener
 
@@ -272,8 +504,9 @@ class CamerasInterface:
         use_timestamp: bool = True,
         timestamp: t.Optional[datetime.datetime] = None,
         format: str = None,
-    ) -> t.Iterable[str]:
-        port_paths = set(get_camera_ports())
+    ) -> t.Sequence[Photo]:
+        """Take a photo from each connected camera."""
+        port_paths = set(self.registry.ports())
         # Teardown any old ports
         # we need to make a list out of the items so that we
         # aren't maintaining a live view, so that we can
@@ -302,33 +535,29 @@ class CamerasInterface:
                     format=format,
                 )
             )
-        # Collect the photo path from each
-        paths = [
+        # Collect the photo from each
+        photos = [
             manager.get_result(grace_wait=config.readers.grace_wait)
             for manager in self.cameras.values()
         ]
-        logger.info("Photos: %s", paths)
-        return paths
+        logger.info("Photos: %s", [photo.path for photo in photos])
+        return photos
 
 
 def encode_image(path: str) -> str:
     """Encode an image from a file path into unicode base64.
 
     Also scales the image to display and transport reasonably."""
-    HEIGHT = 300
-    # Read and resize photo
-    loaded_photo = cv2.imread(path)
-    loaded_photo = cv2.resize(
-        loaded_photo,
-        # dsize is (width, height), but .shape is (rows, columns)
-        dsize=(int(loaded_photo.shape[1] / loaded_photo.shape[0] * HEIGHT), HEIGHT),
-        interpolation=cv2.INTER_AREA,
-    )
-    # Encode into jpg and then b64 of that jpg
-    # Allows easy sending over http and then loading into html img tag
-    jpg_bytes = cv2.imencode(".jpg", loaded_photo)[1].tobytes()
-    b64_encoding = base64.b64encode(jpg_bytes).decode("ascii")
-    return b64_encoding
+    with open(path, "rb") as file:
+        return encode_thumbnail(thumbnail(file.read()))
+
+
+def encode_thumbnail(jpg_bytes: bytes) -> str:
+    """Encode a thumbnail into unicode base64.
+
+    Allows easy sending over http and then loading into html img tag.
+    """
+    return base64.b64encode(jpg_bytes).decode("ascii")
 
 
 def cameras_info() -> t.Sequence[t.Sequence[str]]:
@@ -10,6 +10,7 @@ import time
 import typing as t
 
 from . import config
+from . import derivatives
 from . import devices
 from . import files
 from . import lights
@@ -28,10 +29,26 @@ def area(dimensions: t.Tuple[float, float]) -> float:
 x = area((3, 2))
 
 # (str, str) or (float, float)?
-def read_bounds(threshold: int = 0) -> t.Tuple[float, float]:
-    """Obtain the bounds provided by the camera station."""
+def read_bounds(
+    threshold: int = 0, still: bool = True, after: t.Optional[float] = None
+) -> t.Tuple[float, float]:
+    """Obtain the bounds provided by the camera station.
+
+    Measures a full resolution still if `still` is True,
+    otherwise the current (low resolution) preview frame.
+
+    If `after` (as from time.time()) is given,
+    only a frame whose exposure began after then is measured.
+    """
     try:
-        sizes = devices.get_camera().get_processed_frame(threshold=threshold)[1]
+        cam = devices.get_camera()
+        if still:
+            frame = cam.capture_still(after=after)
+        elif after is not None:
+            frame = cam.wait_frame(after=after)
+        else:
+            frame = None
+        sizes = cam.get_measurement(frame, threshold=threshold).sizes
     except Exception as e:
         logger.error(e)
         size = (0.0, 0.0)
@@ -44,6 +61,19 @@ def read_bounds(threshold: int = 0) -> t.Tuple[float, float]:
     return size
 
 
+def calibrate_background(frames: int = 1) -> None:
+    """Calibrate the under camera's model of the empty platform.
+
+    Averages full resolution stills taken with the lights off,
+    so the platform must be empty.
+    """
+    lights.Lights().ring().off()
+    # Let auto exposure settle with the lights off
+    time.sleep(config.process.camera.settle)
+    settled = time.time()
+    devices.get_camera().calibrate_background(frames=frames, after=settled)
+
+
 def format_bounds(bounds: t.Tuple[float, float]) -> str:
     """Create formatted string version of bounds."""
     p = config.camera.precision
@@ -105,7 +135,7 @@ def take_photos(
 ) -> t.List[str]:
     """Takes a set of photos, saving onto disk and returning base64 encodings."""
     try:
-        photo_paths = devices.get_cameras().capture_image_set(
+        photos = devices.get_cameras().capture_image_set(
             folder=str(folder),
             use_timestamp=use_timestamp,
             timestamp=timestamp,
@@ -116,7 +146,11 @@ def take_photos(
         logger.error(e)
         return []
     else:
-        return [photo.encode_image(path) for path in photo_paths]
+        for taken in photos:
+            # Keep the thumbnail made while the photo was in memory,
+            # and make the other derivatives in the background
+            derivatives.store.submit(taken.path, seeds={"thumbnail": taken.thumbnail})
+        return [photo.encode_thumbnail(taken.thumbnail) for taken in photos]
 
 
 def collect_photos(query: str, light_level: float = 1) -> t.List[str]:
@@ -183,9 +217,12 @@ def collect_data(
     else:
         # Make sure lights are turned off
         lights.Lights().ring().off()
-        time.sleep(config.process.camera.wait)
-        # Read bounds from undercamera
-        size = read_bounds(threshold=threshold)
+        # Let auto exposure settle with the lights off
+        time.sleep(config.process.camera.settle)
+        settled = time.time()
+        # Read bounds from undercamera,
+        # from the first frame exposed entirely after settling
+        size = read_bounds(threshold=threshold, after=settled)
 
     if override_height is not None:
         height = override_height
@@ -299,8 +336,16 @@ def retrieve(ilc: str) -> t.Optional[t.Mapping[str, object]]:
 
     # Retrieve images
     images = [
-        photo.encode_image(str(path))
-        for path in data_folder.joinpath(config.process.paths.photos).glob("*.jpg")
+        photo.encode_thumbnail(thumbnail)
+        for thumbnail in derivatives.store.read_many(
+            sorted(
+                str(path)
+                for path in data_folder.joinpath(config.process.paths.photos).glob(
+                    "*.jpg"
+                )
+            ),
+            "thumbnail",
+        )
     ]
 
     data["photos"] = images
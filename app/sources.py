@@ -0,0 +1,351 @@
+"""Sources of under camera frames: the PiCamera, or recordings replayed from disk.
+
+Recordings let the vision pipeline run, and be profiled, away from the Pi.
+"""
+
+import logging
+import os
+import threading
+import time
+import typing as t
+
+import cv2
+import numpy
+
+from . import camera
+from . import config
+
+if t.TYPE_CHECKING:
+    import picamera
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+Image = camera.Image
+
+# A captured frame: (image, capture time, exposure start time), as from time.time()
+Capture = t.Tuple[Image, float, float]
+
+# Image files replayed from a directory, by extension
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class FrameSource:
+    """Abstract source of frames for camera.Camera.
+
+    Used as a context manager, staying open while frames are read.
+    """
+
+    def __enter__(self) -> "FrameSource":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the source, base method."""
+
+    def frames(
+        self, resolution: t.Tuple[int, int], buffers: camera.BufferPool
+    ) -> t.Iterator[Capture]:
+        """Yield preview frames of the given (width, height), for as long as wanted.
+
+        Frames may be written into `buffers`.
+        """
+        raise NotImplementedError
+
+    def still(self, buffers: camera.BufferPool) -> Capture:
+        """Capture a full resolution frame while .frames runs.
+
+        Frames may be written into `buffers`.
+        """
+        raise NotImplementedError
+
+
+def padded_resolution(resolution: t.Tuple[int, int]) -> t.Tuple[int, int]:
+    """(width, height) of raw PiCamera frames, padded to 32 columns and 16 rows.
+
+    As picamera.array.raw_resolution.
+    """
+    width, height = resolution
+    return ((width + 31) // 32 * 32, (height + 15) // 16 * 16)
+
+
+class PooledArray:
+    """Output for picamera's unencoded captures, writing frames into pooled buffers.
+
+    Each frame is written straight into a buffer from a BufferPool,
+    so there is nothing to copy afterwards. A buffer is only reused
+    once nothing references the frame in it, so a consumer keeps its frame
+    (its lease on the buffer) for as long as it holds on to the frame.
+
+    For YUV captures only the Y (luma) plane is kept: it is the full resolution
+    grayscale image, so it can be used directly without any colour conversion,
+    and the chroma planes that follow it are skipped over.
+    """
+
+    def __init__(
+        self,
+        resolution: t.Tuple[int, int],
+        channels: int = 1,
+        buffers: t.Optional[camera.BufferPool] = None,
+    ) -> None:
+        """Construct an output for frames of the given (width, height).
+
+        `channels` is 1 for the luma plane of YUV captures, or 3 for BGR.
+        """
+        self.resolution = resolution
+        padded_width, padded_height = padded_resolution(resolution)
+        self.shape: t.Tuple[int, ...] = (padded_height, padded_width)
+        if channels > 1:
+            self.shape += (channels,)
+        self.buffers = buffers if buffers is not None else camera.BufferPool(0)
+        self.padded: t.Optional[numpy.ndarray] = None
+        self.offset = 0
+
+    def write(self, data: bytes) -> int:
+        """Write the next piece of a frame, keeping the part within the buffer."""
+        if self.padded is None:
+            # Start of a frame
+            self.padded = self.buffers.take(self.shape)
+        flat = self.padded.reshape(-1)
+        start = self.offset
+        end = min(start + len(data), flat.size)
+        if end > start:
+            flat[start:end] = numpy.frombuffer(data, dtype=numpy.uint8)[: end - start]
+        self.offset += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        """Called by picamera at the end of each frame."""
+
+    def truncate(self, size: int = 0) -> None:
+        """Prepare to receive the next frame, into another buffer.
+
+        The last frame is left to whoever still holds it.
+        """
+        self.offset = size
+        self.padded = None
+
+    @property
+    def array(self) -> Image:
+        """The last frame, without padding."""
+        assert self.padded is not None, "No frame has been written"
+        width, height = self.resolution
+        return self.padded[:height, :width]
+
+
+def open_camera() -> "picamera.PiCamera":
+    """Open a properly configured PiCamera.
+
+    Opens at the full measurement resolution;
+    the preview stream is resized down from it.
+    """
+    # Imported here, so nothing else needs picamera installed
+    import picamera
+
+    resolution = tuple(config.camera.resolution)
+    # framerate = 32
+    return picamera.PiCamera(resolution=resolution)
+
+
+def capture_output(
+    cam: "picamera.PiCamera",
+    resolution: t.Optional[t.Tuple[int, int]] = None,
+    buffers: t.Optional[camera.BufferPool] = None,
+) -> t.Tuple[PooledArray, str]:
+    """Construct an output and picamera format for the configured capture mode.
+
+    "luma" captures grayscale frames straight from the YUV stream,
+    "bgr" captures colour frames.
+
+    Frames are expected at the given (width, height),
+    or the camera resolution if not given,
+    and are written into the given buffers.
+    """
+    if resolution is None:
+        resolution = cam.resolution
+    if config.camera.capture == "luma":
+        return (PooledArray(resolution, buffers=buffers), "yuv")
+    return (PooledArray(resolution, channels=3, buffers=buffers), "bgr")
+
+
+def exposure_latency(cam: "picamera.PiCamera") -> float:
+    """Estimate the seconds between a frame starting exposure and being captured.
+
+    The exposure time and a frame period for readout only bound it from below,
+    as resizing and delivering the frame take time too,
+    so the configured margin is added to err on the long side.
+    """
+    return (
+        cam.exposure_speed / 1_000_000
+        + 1 / float(cam.framerate)
+        + config.camera.exposure_margin
+    )
+
+
+class PiCameraSource(FrameSource):
+    """Frames from the PiCamera.
+
+    The preview is resized down from the full resolution by the camera,
+    and stills are captured on a seperate splitter port,
+    so the preview keeps running.
+    """
+
+    # Seconds for the camera to warm up after opening
+    WARMUP_TIME: float = 2
+    # Splitter port used for stills, the preview stream uses the default port 0
+    STILL_PORT: int = 1
+
+    def __init__(self) -> None:
+        """Open the PiCamera."""
+        self.camera = open_camera()
+        logger.info("Started PiCamera")
+
+    def close(self) -> None:
+        """Close the PiCamera."""
+        self.camera.close()
+        logger.info("Closed PiCamera.")
+
+    def frames(
+        self, resolution: t.Tuple[int, int], buffers: camera.BufferPool
+    ) -> t.Iterator[Capture]:
+        # Wait for camera to warm up
+        # camera.start_preview()
+        time.sleep(self.WARMUP_TIME)
+
+        # Create array output for cam output
+        capture, format = capture_output(self.camera, resolution, buffers)
+
+        # Create a generator that will output into capture
+        # on each iteration, resized down for the preview
+        generator = self.camera.capture_continuous(
+            capture, format=format, use_video_port=True, resize=resolution
+        )
+
+        # We don't actually use the output of the generator
+        for _ in generator:
+            # Extract the numpy frame, which stays in its pooled buffer
+            # until every holder of the frame lets go of it
+            image = capture.array
+            # Truncate so the next frame goes into a free buffer
+            capture.truncate(0)
+            timestamp = time.time()
+            yield (image, timestamp, timestamp - exposure_latency(self.camera))
+
+    def still(self, buffers: camera.BufferPool) -> Capture:
+        capture, format = capture_output(self.camera, buffers=buffers)
+        self.camera.capture(
+            capture,
+            format=format,
+            use_video_port=True,
+            splitter_port=self.STILL_PORT,
+        )
+        timestamp = time.time()
+        return (capture.array, timestamp, timestamp - exposure_latency(self.camera))
+
+
+class ReplaySource(FrameSource):
+    """Frames replayed from recorded images in a directory, or a video file.
+
+    Recordings should be at the full measurement resolution:
+    stills are the recorded frames, and the preview is resized down from them.
+    Frames are converted to match the configured capture mode.
+    """
+
+    def __init__(self, path: str, rate: float = 0, loop: bool = True) -> None:
+        """Construct a new ReplaySource.
+
+        Frames are replayed at `rate` per second, or as fast as possible if 0,
+        starting over at the end of the recording if `loop` is set.
+        """
+        self.path = path
+        self.rate = rate
+        self.loop = loop
+        self.gray = config.camera.capture == "luma"
+        # Most recent full resolution frame, given out as the still
+        self.current: t.Optional[Image] = None
+        self.lock = threading.Lock()
+        if os.path.isdir(path):
+            self.files: t.Optional[t.List[str]] = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not self.files:
+                raise FileNotFoundError(f"No images to replay in {path}.")
+        elif os.path.isfile(path):
+            self.files = None
+        else:
+            raise FileNotFoundError(f"No recording at {path}.")
+
+    def recording(self) -> t.Iterator[Image]:
+        """Yield each recorded frame once, in the configured capture mode."""
+        if self.files is not None:
+            flags = cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR
+            for file in self.files:
+                image = cv2.imread(file, flags)
+                if image is None:
+                    logger.warning("Skipping unreadable image %s", file)
+                    continue
+                yield image
+        else:
+            video = cv2.VideoCapture(self.path)
+            try:
+                while True:
+                    ok, image = video.read()
+                    if not ok:
+                        break
+                    if self.gray:
+                        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                    yield image
+            finally:
+                video.release()
+
+    def frames(
+        self, resolution: t.Tuple[int, int], buffers: camera.BufferPool
+    ) -> t.Iterator[Capture]:
+        period = 1 / self.rate if self.rate > 0 else 0
+        deadline = time.monotonic()
+        while True:
+            replayed = 0
+            for image in self.recording():
+                replayed += 1
+                with self.lock:
+                    self.current = image
+                preview = image
+                if (image.shape[1], image.shape[0]) != tuple(resolution):
+                    preview = cv2.resize(
+                        image,
+                        tuple(resolution),
+                        interpolation=cv2.INTER_AREA,
+                        dst=buffers.take(
+                            (resolution[1], resolution[0]) + image.shape[2:]
+                        ),
+                    )
+                # Keep to the rate, without drifting
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.monotonic()
+                timestamp = time.time()
+                yield (preview, timestamp, timestamp)
+            if not self.loop or not replayed:
+                break
+
+    def still(self, buffers: camera.BufferPool) -> Capture:
+        with self.lock:
+            image = self.current
+        if image is None:
+            raise RuntimeError("No frame has been replayed yet.")
+        timestamp = time.time()
+        return (image, timestamp, timestamp)
+
+
+def configured() -> FrameSource:
+    """Open the source selected by config, the PiCamera or a recording."""
+    if config.camera.source == "picamera":
+        return PiCameraSource()
+    return ReplaySource(config.camera.source, rate=config.camera.replay_rate)
@@ -337,6 +337,13 @@
         },
         "mount_device": writeMountResult,
         "unmount_device": writeMountResult,
+        // Show calibration coverage on the stream while calibrating
+        "calibration/start": function (response) {
+            document.getElementById("cameraStream").src = "/calibration/camera";
+        },
+        "calibration/stop": function (response) {
+            document.getElementById("cameraStream").src = "/camera";
+        },
     };
 
     setup_actions(action_gatherers, action_handlers);
@@ -0,0 +1,144 @@
+"""Share a single processed camera stream between many clients."""
+
+import logging
+import threading
+import time
+import typing as t
+
+from . import camera
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Streamable(t.Protocol):
+    """Anything frames can be streamed from: a camera, or e.g. a calibration view."""
+
+    def wait_frame(
+        self,
+        newer_than: int = 0,
+        timeout: t.Optional[float] = None,
+        *,
+        after: t.Optional[float] = None,
+    ) -> camera.Frame:
+        """Wait for a frame, as camera.Camera.wait_frame."""
+
+    def get_jpg(self, frame: camera.Frame, **options: t.Any) -> bytes:
+        """Encode a frame for streaming."""
+
+
+class Broadcaster:
+    """Processes and encodes camera frames once for any number of stream clients.
+
+    A single thread produces JPEG frames while anyone is subscribed,
+    and stops once the last subscriber leaves.
+
+    Subscribers only ever receive the latest frame,
+    so a slow client skips frames instead of queueing them
+    or holding up the others.
+    """
+
+    # Seconds to wait before retrying after the camera fails
+    RETRY_TIME: float = 1
+    # Seconds after which a subscriber is sent the latest frame again,
+    # if nothing new was published (e.g. the scene is static)
+    HEARTBEAT_TIME: float = 1
+
+    def __init__(
+        self,
+        camera_factory: t.Callable[[], Streamable],
+        options: t.Callable[[], t.Mapping[str, t.Any]],
+    ) -> None:
+        """Construct a new Broadcaster.
+
+        `camera_factory` is called once each time the encoding thread starts,
+        and `options` is called for every frame to get the processing options
+        (e.g. threshold), so that changes take effect on the live stream.
+        """
+        self.camera_factory = camera_factory
+        self.options = options
+
+        self.condition = threading.Condition()
+        self.thread: t.Optional[threading.Thread] = None
+        self.subscribers: int = 0
+
+        # Latest encoded frame, and how many frames have been published
+        self.jpg: t.Optional[bytes] = None
+        self.index: int = 0
+
+    def start(self) -> None:
+        """Start the encoding thread if it is not running.
+
+        Must be called while holding the condition.
+        """
+        if self.thread is None:
+            logger.debug("Starting broadcast thread")
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self) -> None:
+        """Encode frames until there are no subscribers left.
+
+        Should not be called manually, is run in a thread by .start.
+        """
+        cam = self.camera_factory()
+        # Sequence number of the last frame that was encoded
+        sequence = 0
+        while True:
+            with self.condition:
+                if self.subscribers <= 0:
+                    # Remove this thread so the next subscriber starts a new one
+                    self.thread = None
+                    self.jpg = None
+                    break
+            try:
+                # Only encode frames the camera has not already given us,
+                # with a timeout so that unsubscribing is noticed
+                frame = cam.wait_frame(newer_than=sequence, timeout=self.RETRY_TIME)
+                jpg = cam.get_jpg(frame, **self.options())
+                sequence = frame.sequence
+            except TimeoutError:
+                continue
+            except Exception as e:
+                logger.error(e)
+                time.sleep(self.RETRY_TIME)
+                continue
+            with self.condition:
+                # An unchanged scene gives back the very same encoding,
+                # which clients already have
+                if jpg is not self.jpg:
+                    self.jpg = jpg
+                    self.index += 1
+                    self.condition.notify_all()
+        logger.debug("Stopped broadcast thread")
+
+    def frames(self) -> t.Generator[bytes, None, None]:
+        """Yield each newly published frame for one subscriber.
+
+        The latest frame is yielded again every HEARTBEAT_TIME seconds
+        while nothing new is published. Clients often only show a frame
+        once the next one starts arriving, and a server only notices
+        a client has gone when writing to it.
+
+        The subscription lasts until the generator is closed,
+        e.g. when the client disconnects.
+        """
+        with self.condition:
+            self.subscribers += 1
+            self.start()
+            # A new subscriber starts from the current frame, if there is one
+            seen = self.index if self.jpg is None else self.index - 1
+        try:
+            while True:
+                with self.condition:
+                    while self.index <= seen or self.jpg is None:
+                        if not self.condition.wait(self.HEARTBEAT_TIME):
+                            # Nothing new, so send the latest frame again
+                            if self.jpg is not None:
+                                break
+                    jpg = self.jpg
+                    seen = self.index
+                yield jpg
+        finally:
+            with self.condition:
+                self.subscribers -= 1
@@ -0,0 +1,119 @@
+"""Optional timings of the vision pipeline's stages.
+
+Durations are kept in rolling windows, summarised as histograms,
+which can be read (e.g. from the /timings endpoint) and are logged periodically.
+
+Disabled by config, in which case nothing is timed at all:
+callers check .enabled, or use .timed, which hands back functions untouched.
+"""
+
+import bisect
+import collections
+import logging
+import statistics
+import threading
+import time
+import typing as t
+
+from . import config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+T = t.TypeVar("T")
+
+enabled: bool = config.timing.enabled
+
+# Upper bounds (in milliseconds) of the histogram buckets, the last is unbounded
+BUCKETS: t.Tuple[float, ...] = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Durations of the most recent runs of a stage."""
+
+    def __init__(self, window: int) -> None:
+        """Construct a Histogram keeping the last `window` durations."""
+        self.samples: t.Deque[float] = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        """Add a duration."""
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> t.Dict[str, t.Any]:
+        """Summarise the window, in milliseconds."""
+        samples = sorted(sample * 1000 for sample in self.samples)
+        buckets = [0] * (len(BUCKETS) + 1)
+        for sample in samples:
+            buckets[bisect.bisect_left(BUCKETS, sample)] += 1
+        return {
+            "count": self.count,
+            "window": len(samples),
+            "mean_ms": statistics.mean(samples) if samples else 0.0,
+            "median_ms": statistics.median(samples) if samples else 0.0,
+            "p95_ms": samples[int(len(samples) * 0.95)] if samples else 0.0,
+            "max_ms": samples[-1] if samples else 0.0,
+            # Counts of durations up to each bound, and any longer
+            "buckets": dict(zip([*map(str, BUCKETS), "inf"], buckets)),
+        }
+
+
+_histograms: t.Dict[str, Histogram] = {}
+_lock = threading.Lock()
+_reporter: t.Optional[threading.Thread] = None
+
+
+def record(name: str, seconds: float) -> None:
+    """Record a duration of the named stage.
+
+    Starts logging summaries periodically, if configured.
+    """
+    global _reporter
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(config.timing.window)
+        histogram.add(seconds)
+        if _reporter is None and config.timing.log_interval > 0:
+            _reporter = threading.Thread(target=_report, daemon=True)
+            _reporter.start()
+
+
+def timed(name: str, function: t.Callable[[], T]) -> t.Callable[[], T]:
+    """Wrap a function to record how long it takes, when timing is enabled.
+
+    Otherwise the function is returned as is.
+    """
+    if not enabled:
+        return function
+
+    def timed_function() -> T:
+        start = time.perf_counter()
+        try:
+            return function()
+        finally:
+            record(name, time.perf_counter() - start)
+
+    return timed_function
+
+
+def snapshot() -> t.Dict[str, t.Any]:
+    """Summaries of every stage timed so far, by stage name."""
+    with _lock:
+        stages = {name: histogram.summary() for name, histogram in _histograms.items()}
+    return {"enabled": enabled, "stages": stages}
+
+
+def _report() -> None:
+    """Log the median and 95th percentile of each stage, periodically."""
+    while True:
+        time.sleep(config.timing.log_interval)
+        stages = snapshot()["stages"]
+        logger.info(
+            "Stage timings (median / p95 ms): %s",
+            ", ".join(
+                f"{name} {stage['median_ms']:.2f} / {stage['p95_ms']:.2f}"
+                for name, stage in sorted(stages.items())
+            ),
+        )
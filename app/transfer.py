@@ -7,6 +7,7 @@ import subprocess
 import typing as t
 
 from . import config
+from . import derivatives
 from . import files
 
 logger = logging.getLogger(__name__)
@@ -27,7 +28,15 @@ def export_data(data_folder: str, destination: str) -> None:
         # Use rsync to copy over
         try:
             subprocess.run(
-                ["rsync", "-a", str(data_path), str(destination_path)], check=True
+                [
+                    "rsync",
+                    "-a",
+                    # Derivatives of photos can be made again from them
+                    f"--exclude={derivatives.DIRECTORY}",
+                    str(data_path),
+                    str(destination_path),
+                ],
+                check=True,
             )
         except subprocess.CalledProcessError as e:
             logger.error(e)
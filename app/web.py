@@ -1,16 +1,19 @@
 """Testing webapp"""
 
 import logging
+import os
 import typing as t
 
 import flask
+import werkzeug.security
 
-from . import camera
 from . import calibrate
 from . import config
+from . import derivatives
 from . import devices
 from . import lights
 from . import process
+from . import stream
 
 # Enable logging
 root_logger = logging.getLogger()
@@ -48,36 +51,89 @@ def create_app() -> flask.Flask:
         """Index page"""
         return flask.render_template("index.html")
 
-    # https://blog.miguelgrinberg.com/post/video-streaming-with-flask
-    @app.route("/camera")
-    def video_feed() -> flask.Response:
-        """Returns the modified camera stream."""
+    # Single producer of stream frames, shared between all clients
+    broadcaster = stream.Broadcaster(
+        devices.get_camera,
+        lambda: {"threshold": app.config.get("threshold", config.web.threshold)},
+    )
 
-        pi_camera = devices.get_camera()
+    # Live chessboard calibration, streamed through its own broadcaster
+    calibration_session = calibrate.CalibrationSession(
+        devices.get_camera, calibrate.BOARD_WIDTH, calibrate.BOARD_HEIGHT
+    )
+    calibration_broadcaster = stream.Broadcaster(
+        lambda: calibration_session, lambda: {}
+    )
+
+    # https://blog.miguelgrinberg.com/post/video-streaming-with-flask
+    def stream_response(source: stream.Broadcaster) -> flask.Response:
+        """Stream a broadcaster's frames as a multipart response."""
 
         # inner generator
-        def gen(cam: camera.Camera) -> t.Generator[bytes, None, None]:
+        def gen() -> t.Generator[bytes, None, None]:
             """Yields byte content of responses to reply with."""
+            frames = source.frames()
             try:
-                while True:
-                    frame = cam.get_jpg(
-                        threshold=app.config.get("threshold", config.web.threshold)
+                for frame in frames:
+                    yield (
+                        b"--frame\r\n"
+                        + b"Content-Type: image/jpeg\r\n\r\n"
+                        + frame
+                        + b"\r\n"
                     )
-                    yield b"--frame\r\n" + b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n"
             finally:
-                pass
-                # close_camera()
+                # Unsubscribe as soon as the client goes away
+                frames.close()
 
         # return a response streaming from the camera
         return flask.Response(
-            gen(pi_camera), mimetype="multipart/x-mixed-replace; boundary=frame"
+            gen(), mimetype="multipart/x-mixed-replace; boundary=frame"
         )
 
+    @app.route("/camera")
+    def video_feed() -> flask.Response:
+        """Returns the modified camera stream."""
+        return stream_response(broadcaster)
+
+    @app.route("/calibration/camera")
+    def calibration_feed() -> flask.Response:
+        """Returns the camera stream with calibration coverage drawn on."""
+        return stream_response(calibration_broadcaster)
+
+    @app.route("/calibration")
+    def calibration_status() -> flask.Response:
+        """Returns the state of the calibration session."""
+        return flask.jsonify(calibration_session.status())
+
+    @app.route("/calibration/start", methods=["POST"])
+    def start_calibration() -> flask.Response:
+        """Start snapping chessboard stills automatically."""
+        calibration_session.start()
+        return flask.jsonify(calibration_session.status())
+
+    @app.route("/calibration/stop", methods=["POST"])
+    def stop_calibration() -> flask.Response:
+        """Stop the calibration session, keeping its coverage."""
+        calibration_session.stop()
+        return flask.jsonify(calibration_session.status())
+
+    @app.route("/calibration/reset", methods=["POST"])
+    def reset_calibration() -> flask.Response:
+        """Forget the calibration session's coverage."""
+        calibration_session.reset()
+        return flask.jsonify(calibration_session.status())
+
+    @app.route("/timings")
+    def get_timings() -> flask.Response:
+        """Returns timings of the camera processing stages, if enabled."""
+        return flask.jsonify(devices.get_camera().get_timings())
+
     @app.route("/snap", methods=["POST"])
     def snap_corners() -> str:
         """Takes a snapshot and searches for chessboard corners."""
-        # TODO magic numbers
-        calibrate.save_snapshot(7, 5)
+        calibrate.save_snapshot(
+            devices.get_camera(), calibrate.BOARD_WIDTH, calibrate.BOARD_HEIGHT
+        )
         return "Snapped"
 
     @app.route("/config", methods=["POST"])
@@ -122,6 +178,12 @@ def create_app() -> flask.Flask:
         app.config["base_depth"] = depth
         return flask.jsonify({"message": "Platform depth calibrated."})
 
+    @app.route("/calibrate_background", methods=["POST"])
+    def calibrate_background() -> flask.Response:
+        """Calibrate the model of the empty platform."""
+        process.calibrate_background(frames=config.camera.background.frames)
+        return flask.jsonify({"message": "Platform background calibrated."})
+
     @app.route("/weight")
     def get_weight() -> str:
         """Read the scale."""
@@ -140,9 +202,11 @@ def create_app() -> flask.Flask:
         height = process.format_height(
             process.read_height(base=app.config.get("base_depth", 0))
         )
+        # Live values measure the preview frame, which the stream shares
         bounds = process.format_bounds(
             process.read_bounds(
-                threshold=app.config.get("threshold", config.web.threshold)
+                threshold=app.config.get("threshold", config.web.threshold),
+                still=False,
             )
         )
         message = {"weight": weight, "height": height, "bounds": bounds}
@@ -246,6 +310,20 @@ def create_app() -> flask.Flask:
         else:
             return flask.jsonify({"message": "No data.", "valid": False}), 200
 
+    @app.route("/photo/<ilc>/<name>")
+    def get_photo(ilc: str, name: str) -> flask.Response:
+        """Return a smaller version of a saved photo.
+
+        Web sized, unless the `size` parameter asks for a thumbnail.
+        """
+        kind = flask.request.args.get("size", "web")
+        path = werkzeug.security.safe_join(
+            config.process.paths.data, ilc, config.process.paths.photos, name
+        )
+        if kind not in derivatives.HEIGHTS or path is None or not os.path.isfile(path):
+            flask.abort(404)
+        return flask.Response(derivatives.store.read(path, kind), mimetype="image/jpeg")
+
     @app.route("/export", methods=["POST"])
     def export_data() -> flask.Response:
         """Export local data to an external location."""
@@ -0,0 +1,382 @@
+"""Run the under camera and its image processing in a seperate process.
+
+Python code handling frames (processing glue, drawing, encoding)
+otherwise holds the GIL against web requests and device readers.
+
+The worker process owns the camera, and the web process talks to it
+through a pipe. Frames the web process asks for are copied into
+shared memory, and processing results are sent back over the pipe.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import typing as t
+
+import numpy
+
+from . import camera
+from . import config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Frames are referred to across the pipe as (kind, slot, sequence, timestamp, started)
+FrameRef = t.Tuple[str, int, int, float, float]
+
+# Requests are (id, method, arguments), responses are (id, succeeded, result)
+Request = t.Tuple[int, str, t.Mapping[str, t.Any]]
+Response = t.Tuple[int, bool, t.Any]
+
+# Threads handling requests in the worker, as some wait on the camera
+WORKER_THREADS = 8
+
+# Seconds to wait for the worker to answer a request,
+# beyond any time the request itself may wait
+RESPONSE_TIME = 30
+
+
+class Geometry(t.NamedTuple):
+    """A camera.Sizing as sent back from the worker, without its images."""
+
+    rects: t.Sequence[camera.Rect]
+    sizes: t.Sequence[t.Tuple[float, float]]
+
+
+def frame_shape(resolution: t.Sequence[int]) -> t.Tuple[int, ...]:
+    """Shape of captured frames of the given (width, height)."""
+    width, height = resolution
+    if config.camera.capture == "luma":
+        return (height, width)
+    return (height, width, 3)
+
+
+class FrameSlots:
+    """Frames of one kind (preview or still) in a block of shared memory.
+
+    Slots are handed out in turn, so a frame is overwritten
+    once that many later frames have been shared.
+    """
+
+    def __init__(self, shape: t.Tuple[int, ...], count: int) -> None:
+        """Allocate shared memory for `count` frames of the given shape."""
+        self.shape = shape
+        self.count = count
+        self.memory = multiprocessing.RawArray("B", int(numpy.prod(shape)) * count)
+
+    @property
+    def frames(self) -> numpy.ndarray:
+        """Every slot, as one array indexed by slot."""
+        return numpy.frombuffer(self.memory, dtype=numpy.uint8).reshape(
+            (self.count, *self.shape)
+        )
+
+
+class Server:
+    """Serves camera requests from the web process, inside the worker process."""
+
+    def __init__(
+        self,
+        connection: multiprocessing.connection.Connection,
+        slots: t.Mapping[str, FrameSlots],
+        cam: camera.Camera,
+    ) -> None:
+        """Construct a new Server answering on the connection."""
+        self.connection = connection
+        self.cam = cam
+        self.slots = {kind: slot.frames for kind, slot in slots.items()}
+        self.next_slot = {kind: 0 for kind in slots}
+        # Frames that were shared, by sequence number,
+        # so they can be passed back for processing
+        self.shared: t.OrderedDict[int, t.Tuple[FrameRef, camera.Frame]] = (
+            collections.OrderedDict()
+        )
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+
+    def share(self, kind: str, frame: camera.Frame) -> FrameRef:
+        """Copy the frame into shared memory, if it is not there already."""
+        with self.lock:
+            if frame.sequence in self.shared:
+                return self.shared[frame.sequence][0]
+            slot = self.next_slot[kind]
+            self.next_slot[kind] = (slot + 1) % len(self.slots[kind])
+            # Forget whichever frame was in the slot
+            for sequence, (ref, _) in list(self.shared.items()):
+                if ref[0] == kind and ref[1] == slot:
+                    del self.shared[sequence]
+            self.slots[kind][slot] = frame.image
+            ref = (kind, slot, frame.sequence, frame.timestamp, frame.started)
+            self.shared[frame.sequence] = (ref, frame)
+            return ref
+
+    def frame(self, sequence: t.Optional[int]) -> t.Optional[camera.Frame]:
+        """Look up a shared frame by sequence number, None for the current frame."""
+        if sequence is None:
+            return None
+        with self.lock:
+            try:
+                return self.shared[sequence][1]
+            except KeyError:
+                raise KeyError(f"Frame {sequence} is no longer shared.") from None
+
+    def handle(self, method: str, arguments: t.Mapping[str, t.Any]) -> t.Any:
+        """Run a request on the camera."""
+        cam = self.cam
+        if method == "wait_frame":
+            return self.share("preview", cam.wait_frame(**arguments))
+        if method == "capture_still":
+            return self.share("still", cam.capture_still(**arguments))
+        if method == "get_measurement":
+            frame = self.frame(arguments["sequence"])
+            measurement = cam.get_measurement(frame, **arguments["options"])
+            # Images stay behind, only the geometry is sent
+            if isinstance(measurement, camera.Sizing):
+                return Geometry(measurement.rects, measurement.sizes)
+            return measurement
+        if method == "get_jpg":
+            frame = self.frame(arguments["sequence"])
+            return cam.get_jpg(frame, **arguments["options"])
+        if method == "calibrate_background":
+            return cam.calibrate_background(**arguments)
+        if method == "get_timings":
+            return cam.get_timings()
+        raise ValueError(f"Unknown method {method}.")
+
+    def respond(self, request: Request) -> None:
+        """Handle a request and send back its response."""
+        identifier, method, arguments = request
+        try:
+            response: Response = (identifier, True, self.handle(method, arguments))
+        except Exception as e:
+            response = (identifier, False, e)
+        with self.send_lock:
+            try:
+                self.connection.send(response)
+            except Exception as e:
+                # e.g. an error that cannot be pickled, which is sent as text
+                self.connection.send((identifier, False, RuntimeError(repr(e))))
+
+    def serve(self) -> None:
+        """Handle requests until the web process closes the connection."""
+        with concurrent.futures.ThreadPoolExecutor(WORKER_THREADS) as executor:
+            while True:
+                try:
+                    request = self.connection.recv()
+                except EOFError:
+                    break
+                executor.submit(self.respond, request)
+
+
+def serve(
+    connection: multiprocessing.connection.Connection,
+    slots: t.Mapping[str, FrameSlots],
+) -> None:
+    """Entry point of the worker process."""
+    root_logger = logging.getLogger()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(config.logging.format))
+    root_logger.addHandler(handler)
+    root_logger.setLevel(config.logging.level)
+
+    logger.info("Started vision worker")
+    Server(
+        connection, slots, camera.Camera(processor=camera.configured_sizer())
+    ).serve()
+    logger.info("Stopped vision worker")
+
+
+class VisionWorker:
+    """Manages the worker process from the web process.
+
+    The process is started on the first request,
+    and restarted on the next request if it dies.
+    """
+
+    def __init__(self) -> None:
+        """Construct a new VisionWorker, allocating its shared memory."""
+        # Enough preview frames for the camera's ring and some in use
+        self.slots = {
+            "preview": FrameSlots(
+                frame_shape(config.camera.preview_resolution),
+                config.camera.ring_size + 4,
+            ),
+            "still": FrameSlots(frame_shape(config.camera.resolution), 2),
+        }
+        self.frames = {kind: slots.frames for kind, slots in self.slots.items()}
+
+        # Guards the process and pending requests
+        self.lock = threading.Lock()
+        # Held seperately while sending, as a full pipe blocks
+        # until the dispatcher takes responses off the other way
+        self.send_lock = threading.Lock()
+        self.process: t.Optional[multiprocessing.process.BaseProcess] = None
+        self.connection: t.Optional[multiprocessing.connection.Connection] = None
+        self.ids = itertools.count()
+        # Requests waiting on a response, by id,
+        # with the connection to the worker they were sent to
+        self.pending: t.Dict[
+            int, t.Tuple[multiprocessing.connection.Connection, t.List[t.Any]]
+        ] = {}
+
+    def start(self) -> multiprocessing.connection.Connection:
+        """Start the worker process if it is not running.
+
+        Must be called while holding the lock.
+        """
+        if self.process is None or not self.process.is_alive():
+            # Spawned rather than forked, as this process is full of threads
+            context = multiprocessing.get_context("spawn")
+            connection, child = context.Pipe()
+            self.process = context.Process(
+                target=serve, args=(child, self.slots), daemon=True
+            )
+            self.process.start()
+            child.close()
+            self.connection = connection
+            threading.Thread(
+                target=self.dispatch, args=(connection,), daemon=True
+            ).start()
+        assert self.connection is not None
+        return self.connection
+
+    def dispatch(self, connection: multiprocessing.connection.Connection) -> None:
+        """Hand responses from the worker to the requests waiting on them."""
+        while True:
+            try:
+                identifier, succeeded, result = connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                entry = self.pending.pop(identifier, None)
+            if entry is not None:
+                _, waiting = entry
+                waiting[1:] = [succeeded, result]
+                waiting[0].set()
+        logger.warning("Vision worker stopped")
+        # Fail anything still waiting on this worker,
+        # but not requests already sent to a replacement
+        with self.lock:
+            if self.connection is connection:
+                self.connection = None
+                self.process = None
+            stopped = [
+                identifier
+                for identifier, (sent_to, _) in self.pending.items()
+                if sent_to is connection
+            ]
+            failed = [self.pending.pop(identifier)[1] for identifier in stopped]
+        for waiting in failed:
+            waiting[1:] = [False, RuntimeError("Vision worker stopped.")]
+            waiting[0].set()
+
+    def call(self, method: str, wait: float = 0, **arguments: t.Any) -> t.Any:
+        """Run a method in the worker, returning its result or raising its error.
+
+        Raises TimeoutError if the worker has not answered RESPONSE_TIME seconds
+        after the `wait` seconds the method itself is expected to wait.
+        """
+        waiting: t.List[t.Any] = [threading.Event(), False, None]
+        with self.lock:
+            connection = self.start()
+            identifier = next(self.ids)
+            self.pending[identifier] = (connection, waiting)
+        try:
+            with self.send_lock:
+                connection.send((identifier, method, arguments))
+        except OSError:
+            with self.lock:
+                self.pending.pop(identifier, None)
+            raise RuntimeError("Vision worker stopped.")
+        if not waiting[0].wait(wait + RESPONSE_TIME):
+            with self.lock:
+                self.pending.pop(identifier, None)
+            raise TimeoutError(f"Vision worker did not answer {method}.")
+        _, succeeded, result = waiting
+        if not succeeded:
+            raise result
+        return result
+
+    def frame(self, ref: FrameRef) -> camera.Frame:
+        """The shared frame a reference from the worker refers to.
+
+        The image is only valid until the slot is reused,
+        so copy it to keep it around.
+        """
+        kind, slot, sequence, timestamp, started = ref
+        return camera.Frame(self.frames[kind][slot], sequence, timestamp, started)
+
+
+class WorkerCamera:
+    """Camera running in a VisionWorker, used like camera.Camera."""
+
+    def __init__(self, worker: VisionWorker) -> None:
+        """Construct a new WorkerCamera."""
+        self.worker = worker
+
+    def wait_frame(
+        self,
+        newer_than: int = 0,
+        timeout: t.Optional[float] = None,
+        *,
+        after: t.Optional[float] = None,
+    ) -> camera.Frame:
+        """See camera.Camera.wait_frame."""
+        return self.worker.frame(
+            self.worker.call(
+                "wait_frame",
+                wait=timeout or 0,
+                newer_than=newer_than,
+                after=after,
+                timeout=timeout,
+            )
+        )
+
+    def capture_still(self, after: t.Optional[float] = None) -> camera.Frame:
+        """See camera.Camera.capture_still."""
+        return self.worker.frame(self.worker.call("capture_still", after=after))
+
+    def get_frame(self) -> camera.Image:
+        """Get the latest image frame."""
+        return self.wait_frame().image
+
+    def get_measurement(
+        self, frame: t.Optional[camera.Frame] = None, **options: t.Any
+    ) -> t.Any:
+        """See camera.Camera.get_measurement.
+
+        Measurements come back without their images, as Geometry.
+        """
+        return self.worker.call(
+            "get_measurement",
+            sequence=None if frame is None else frame.sequence,
+            options=options,
+        )
+
+    def get_jpg(
+        self, frame: t.Optional[camera.Frame] = None, **options: t.Any
+    ) -> bytes:
+        """See camera.Camera.get_jpg."""
+        return self.worker.call(
+            "get_jpg",
+            sequence=None if frame is None else frame.sequence,
+            options=options,
+        )
+
+    def calibrate_background(
+        self, frames: int = 1, after: t.Optional[float] = None
+    ) -> None:
+        """See camera.Camera.calibrate_background."""
+        self.worker.call("calibrate_background", frames=frames, after=after)
+
+    def get_timings(self) -> t.Dict[str, t.Any]:
+        """See camera.Camera.get_timings, timed in the worker."""
+        return self.worker.call("get_timings")
+
+
+# Either kind of camera, as returned by devices.get_camera
+AnyCamera = t.Union[camera.Camera, WorkerCamera]
@@ -0,0 +1,59 @@
+"""Tests of the calibration helpers."""
+
+import time
+
+import cv2
+import numpy
+import pytest
+
+from app import calibrate
+from app import camera
+
+
+def platform_image(width: int, height: int) -> camera.Image:
+    """Calibration image of a bright platform on a dark background."""
+    image = numpy.full((height, width), 30, dtype=numpy.uint8)
+    cv2.rectangle(
+        image,
+        (width // 4, height // 5),
+        (width * 3 // 4 - 1, height * 4 // 5 - 1),
+        220,
+        -1,
+    )
+    return image
+
+
+@pytest.mark.parametrize("width, height", [(640, 480), (1280, 960)])
+def test_platform_roi_is_independent_of_resolution(width: int, height: int) -> None:
+    sizer = camera.ImageSizer(
+        numpy.array([[300.0, 0.0, 160.0], [0.0, 300.0, 120.0], [0.0, 0.0, 1.0]]),
+        numpy.array([-0.3, 0.1, 0.0, 0.0, 0.0]),
+        resolution=(320, 240),
+    )
+    expected = calibrate.platform_roi(platform_image(320, 240), sizer)
+    found = calibrate.platform_roi(platform_image(width, height), sizer)
+    assert found == pytest.approx(expected, abs=0.02)
+
+
+class IdleCamera:
+    """Camera that never has a new frame."""
+
+    def wait_frame(self, newer_than=0, timeout=None, *, after=None):
+        time.sleep(0.05)
+        raise TimeoutError
+
+
+def test_calibration_session_restarts_while_stopping() -> None:
+    session = calibrate.CalibrationSession(IdleCamera, 9, 6)
+    session.start()
+    # As if .stop were called, but its thread had not finished yet
+    with session.lock:
+        session.running = False
+    session.start()
+    try:
+        time.sleep(0.1)
+        assert session.status()["running"]
+        assert session.thread is not None and session.thread.is_alive()
+    finally:
+        session.stop()
+    assert session.thread is None
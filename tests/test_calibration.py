@@ -0,0 +1,73 @@
+"""Tests of loading the under camera's calibration bundle."""
+
+import pathlib
+
+import numpy
+import pytest
+
+from app import calibration
+from app import config
+
+
+@pytest.fixture
+def bundle_path(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Configure a bundle path in a temporary directory."""
+    path = str(tmp_path / "cameraCalibration.npz")
+    monkeypatch.setattr(config.process, "cameraCalibration", path)
+    return path
+
+
+def custom_calibration() -> calibration.Calibration:
+    """A calibration unlike the legacy matrices."""
+    matrix = numpy.array([[500.0, 0, 640], [0, 500.0, 480], [0, 0, 1]])
+    return calibration.build(
+        matrix, numpy.array([-0.1, 0.01, 0, 0, 0]), (1280, 960), 40.0
+    )
+
+
+def test_missing_bundle_is_built_from_legacy(bundle_path: str) -> None:
+    loaded = calibration.configured()
+    legacy = calibration.from_legacy()
+    numpy.testing.assert_array_equal(loaded.cam_matrix, legacy.cam_matrix)
+    assert pathlib.Path(bundle_path).exists()
+    # Loaded from the saved bundle from then on
+    numpy.testing.assert_array_equal(
+        calibration.configured().cam_matrix, legacy.cam_matrix
+    )
+
+
+def test_old_bundle_is_migrated_from_itself(
+    bundle_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    saved = custom_calibration()
+    calibration.save(saved, bundle_path)
+    monkeypatch.setattr(calibration, "BUNDLE_VERSION", calibration.BUNDLE_VERSION + 1)
+
+    loaded = calibration.configured()
+    numpy.testing.assert_array_equal(loaded.cam_matrix, saved.cam_matrix)
+    assert loaded.resolution == saved.resolution
+    assert loaded.pixels_per_cm == saved.pixels_per_cm
+    # Saved again at the new version, with the same calibration
+    reloaded = calibration.load(bundle_path)
+    numpy.testing.assert_array_equal(reloaded.cam_matrix, saved.cam_matrix)
+
+
+def test_unreadable_bundle_is_not_replaced(bundle_path: str) -> None:
+    with open(bundle_path, "wb") as file:
+        file.write(b"not a bundle")
+    loaded = calibration.configured()
+    numpy.testing.assert_array_equal(
+        loaded.cam_matrix, calibration.from_legacy().cam_matrix
+    )
+    with open(bundle_path, "rb") as file:
+        assert file.read() == b"not a bundle"
+
+
+def test_newer_bundle_is_not_replaced(
+    bundle_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calibration.save(custom_calibration(), bundle_path)
+    before = pathlib.Path(bundle_path).read_bytes()
+    monkeypatch.setattr(calibration, "BUNDLE_VERSION", calibration.BUNDLE_VERSION - 1)
+    calibration.configured()
+    assert pathlib.Path(bundle_path).read_bytes() == before
@@ -0,0 +1,144 @@
+"""Tests of the under camera and its image processing."""
+
+import time
+
+import cv2
+import numpy
+import pytest
+
+from app import camera
+from app import sources
+
+
+def part_with_leads(lead_width: int) -> camera.Image:
+    """Mask of a part's body with a thin lead out of each side."""
+    mask = numpy.zeros((960, 1280), dtype=numpy.uint8)
+    cv2.rectangle(mask, (400, 400), (590, 500), 255, -1)
+    cv2.rectangle(mask, (590, 440), (960, 440 + lead_width - 1), 255, -1)
+    cv2.rectangle(mask, (210, 460), (400, 460 + lead_width - 1), 255, -1)
+    # A speck, too small to keep
+    cv2.rectangle(mask, (100, 100), (102, 102), 255, -1)
+    return mask
+
+
+def measure(mask: camera.Image, levels: int) -> list:
+    """Sizes of the rotated rects of the contours found in the mask."""
+    context = camera.FrameContext(mask, camera.BufferPool(8))
+    found = context.run(camera.contours(camera.SOURCE, levels=levels, min_size=10))
+    return sorted(sorted(cv2.minAreaRect(contour)[1]) for contour in found)
+
+
+@pytest.mark.parametrize("levels", [1, 2, 3, 4])
+@pytest.mark.parametrize("lead_width", [1, 3, 7])
+def test_pyramid_levels_keep_thin_protrusions(levels: int, lead_width: int) -> None:
+    mask = part_with_leads(lead_width)
+    expected = measure(mask, levels=0)
+    assert len(expected) == 1
+    assert measure(mask, levels=levels) == expected
+
+
+class ShortSource(sources.FrameSource):
+    """Source that yields one frame, then stops soon after, as if gone idle."""
+
+    def frames(self, resolution, buffers):
+        yield numpy.zeros(resolution[::-1], dtype=numpy.uint8), 0.0, 0.0
+        time.sleep(0.1)
+
+
+def test_wait_frame_restarts_a_stopped_camera_thread(monkeypatch) -> None:
+    monkeypatch.setattr(camera.Camera, "source_factory", ShortSource)
+    first = camera.Camera.wait_frame(timeout=5)
+    # The thread stops while this waits, and must be started again
+    second = camera.Camera.wait_frame(newer_than=first.sequence, timeout=5)
+    assert second.sequence > first.sequence
+    thread = camera.Camera.thread
+    if thread is not None:
+        thread.join()
+
+
+def test_stages_are_timed_exclusive_of_stages_they_run() -> None:
+    def slow(context: camera.FrameContext) -> None:
+        time.sleep(0.05)
+
+    inner = camera.Stage("inner", slow)
+    outer = camera.Stage("outer", lambda context, _: context.run(inner), (inner,))
+    nested = camera.Stage("nested", lambda context: context.run(inner))
+    timings = {}
+    for stage in (outer, nested):
+        context = camera.FrameContext(
+            numpy.zeros((1, 1), dtype=numpy.uint8),
+            timer=lambda name, seconds: timings.setdefault(name, seconds),
+        )
+        context.run(stage)
+    assert timings["inner"] >= 0.05
+    assert timings["outer"] < 0.01
+    assert timings["nested"] < 0.01
+
+
+class MissingSource(sources.FrameSource):
+    """Source of a camera that isn't there."""
+
+    opened = 0
+
+    def __init__(self) -> None:
+        MissingSource.opened += 1
+        raise OSError("No camera attached.")
+
+
+class EmptySource(sources.FrameSource):
+    """Source that stops without giving a single frame."""
+
+    def frames(self, resolution, buffers):
+        return iter(())
+
+
+@pytest.mark.parametrize("source", [MissingSource, EmptySource])
+def test_wait_frame_reports_a_camera_that_fails_to_start(monkeypatch, source) -> None:
+    monkeypatch.setattr(camera.Camera, "source_factory", source)
+    MissingSource.opened = 0
+    with pytest.raises(RuntimeError):
+        camera.Camera.wait_frame()
+    assert MissingSource.opened <= 1
+    # Asking again tries the camera again
+    with pytest.raises(RuntimeError):
+        camera.Camera.wait_frame()
+
+
+def background_model(path, roi=(0.0, 0.0, 1.0, 1.0)) -> camera.BackgroundModel:
+    """Background model saved to `path`, of `roi` of 640x480 frames."""
+    return camera.BackgroundModel(
+        tolerance=20, rate=0.05, path=str(path), roi=roi, resolution=(640, 480)
+    )
+
+
+def test_background_model_is_kept_for_its_own_area(tmp_path) -> None:
+    path = tmp_path / "background.npz"
+    image = numpy.full((240, 320), 100, dtype=numpy.uint8)
+    background_model(path).calibrate([image], (0.0, 0.0, 1.0, 1.0), (640, 480))
+
+    model = background_model(path)
+    assert model.calibrated
+    # Frames of the same area at another resolution, e.g. the preview
+    mask = model.segment(numpy.full((120, 160), 100, numpy.uint8), camera.BufferPool(0))
+    assert mask is not None and not mask.any()
+    # An image of another shape can't be of the same area
+    assert model.segment(image[:, :100], camera.BufferPool(0)) is None
+
+
+def test_background_model_of_another_region_is_not_used(tmp_path) -> None:
+    path = tmp_path / "background.npz"
+    image = numpy.full((240, 320), 100, dtype=numpy.uint8)
+    background_model(path).calibrate([image], (0.0, 0.0, 1.0, 1.0), (640, 480))
+
+    assert not background_model(path, roi=(0.1, 0.1, 0.9, 0.9)).calibrated
+
+
+@pytest.mark.parametrize("angle", range(0, 90, 5))
+def test_pyramid_levels_find_the_smallest_objects_kept(angle: int) -> None:
+    # A rotated square of exactly min_size, at every offset from the samples
+    for dx in range(10):
+        for dy in range(10):
+            mask = numpy.zeros((200, 200), dtype=numpy.uint8)
+            box = cv2.boxPoints(((100 + dx, 100 + dy), (10, 10), angle))
+            cv2.fillPoly(mask, [numpy.intp(numpy.round(box))], 255)
+            assert measure(mask, 4) == measure(mask, 0)
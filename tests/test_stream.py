@@ -0,0 +1,42 @@
+"""Tests of sharing the camera stream between clients."""
+
+import threading
+import time
+
+import numpy
+
+from app import camera
+from app import stream
+
+
+class StaticCamera:
+    """Camera of a static scene, whose frames all encode to the same JPEG."""
+
+    def __init__(self) -> None:
+        self.jpg = b"jpeg"
+        self.sequence = 0
+
+    def wait_frame(self, newer_than=0, timeout=None, *, after=None):
+        time.sleep(0.01)
+        self.sequence += 1
+        return camera.Frame(numpy.zeros((1, 1)), self.sequence, 0.0, 0.0)
+
+    def get_jpg(self, frame, **options):
+        return self.jpg
+
+
+def test_static_scene_is_resent_on_a_heartbeat(monkeypatch) -> None:
+    monkeypatch.setattr(stream.Broadcaster, "HEARTBEAT_TIME", 0.05)
+    broadcaster = stream.Broadcaster(StaticCamera, lambda: {})
+    frames = broadcaster.frames()
+    received = []
+    reader = threading.Thread(
+        target=lambda: received.extend(next(frames) for _ in range(3)), daemon=True
+    )
+    reader.start()
+    reader.join(timeout=2)
+    assert received == [b"jpeg"] * 3
+    assert broadcaster.index == 1
+
+    frames.close()
+    assert broadcaster.subscribers == 0
@@ -0,0 +1,48 @@
+"""Tests of running the camera in a worker process."""
+
+import threading
+
+import pytest
+
+from app import worker
+
+
+class ClosedConnection:
+    """Connection to a worker that has stopped."""
+
+    def recv(self):
+        raise EOFError
+
+    def send(self, request):
+        pass
+
+
+def pending_request(vision_worker, identifier, connection) -> list:
+    """Register a request as sent over the connection."""
+    waiting = [threading.Event(), False, None]
+    vision_worker.pending[identifier] = (connection, waiting)
+    return waiting
+
+
+def test_stopped_worker_only_fails_its_own_requests() -> None:
+    vision_worker = worker.VisionWorker()
+    stopped, replacement = ClosedConnection(), ClosedConnection()
+    old = pending_request(vision_worker, 1, stopped)
+    new = pending_request(vision_worker, 2, replacement)
+
+    vision_worker.dispatch(stopped)
+
+    assert old[0].is_set() and not old[1]
+    assert isinstance(old[2], RuntimeError)
+    assert not new[0].is_set()
+    assert list(vision_worker.pending) == [2]
+
+
+def test_unanswered_call_times_out(monkeypatch) -> None:
+    vision_worker = worker.VisionWorker()
+    monkeypatch.setattr(worker, "RESPONSE_TIME", 0.05)
+    monkeypatch.setattr(vision_worker, "start", ClosedConnection)
+
+    with pytest.raises(TimeoutError):
+        vision_worker.call("get_timings")
+    assert not vision_worker.pending